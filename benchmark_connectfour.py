@@ -0,0 +1,146 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+
+from minimax_connectfour import Game, MinimaxAgent, game_result
+
+# Reference positions, as the columns played from the empty board with red moving first
+POSITIONS = {
+    'opening-4': '1223',
+    'opening-6': '104332',
+    'middlegame-20': '45340123231332214546',
+    'middlegame-24': '156233373611655526470035',
+    'endgame-44': '25145671656030236644012766510062755054122147',
+    'endgame-48': '632001464721025405376610070051216672421545774511',
+}
+# Positions the macro benchmarks search: red to move, and no forced result within 8 plies to cut the search short
+# (macro_benchmarks checks this)
+SEARCH_POSITIONS = ('opening-4', 'middlegame-20', 'endgame-44')
+SEARCH_DEPTHS = (4, 5, 6, 7, 8)
+
+
+def position(moves):
+    """Return the Game reached by playing a string of columns from the empty board."""
+    game = Game([['-' for i in range(8)] for j in range(8)])
+    for ply, col in enumerate(moves):
+        game.make_move(int(col), 'RB'[ply % 2])
+    return game
+
+
+def timed(function, repeat=5, number=None):
+    """Return the best seconds per call of function over repeat runs, picking number to make runs ~0.1s."""
+    if number is None:
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for i in range(number):
+                function()
+            if time.perf_counter() - start >= 0.1:
+                break
+            number *= 2
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def micro_benchmarks():
+    """Time the Game hot paths on every reference position."""
+    results = {}
+    for name, moves in POSITIONS.items():
+        game = position(moves)
+        col = game.possible_moves()[0]
+        color = 'RB'[game.move_count % 2]
+        results['neighbor/' + name] = {'seconds': timed(lambda: game.neighbor(col, color))}
+        results['possible_moves/' + name] = {'seconds': timed(game.possible_moves)}
+        results['winning_state/' + name] = {'seconds': timed(game.winning_state)}
+        results['utility/' + name] = {'seconds': timed(game.utility)}
+    return results
+
+
+def macro_benchmarks(depths=SEARCH_DEPTHS, games=10, seed=0):
+    """Time MinimaxAgent.move on the reference positions at each depth, and a fixed-seed mini tournament."""
+    results = {}
+    for name in SEARCH_POSITIONS:
+        game = position(POSITIONS[name])
+        for depth in depths:
+            agent = MinimaxAgent('R', depth=depth)
+
+            def search():
+                agent.table.clear()
+                agent.move(game)
+            seconds = timed(search, repeat=3, number=1)
+            # A search that ends early on a forced result would time the same tree at every depth
+            if agent.depth_reached != depth:
+                raise ValueError("%s has a forced result within %d plies; it cannot benchmark depth %d"
+                                 % (name, agent.depth_reached, depth))
+            results['move/%s/depth-%d' % (name, depth)] = {'seconds': seconds, 'nodes': agent.nodes}
+    # single_game reports every result on stdout; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        states = [game_result(seed + i)[0] for i in range(games)]
+        seconds = time.perf_counter() - start
+    results['tournament/%d-games' % games] = {
+        'seconds': seconds, 'red_wins': sum(state == float('inf') for state in states)}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print how results compare with a baseline run; return the names of benchmarks that got slower than
+    the threshold allows."""
+    regressions = []
+    for name, result in sorted(results['benchmarks'].items()):
+        if name not in baseline['benchmarks']:
+            continue
+        ratio = result['seconds'] / baseline['benchmarks'][name]['seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print("%-40s %12.3e s  %6.2fx baseline%s" % (name, result['seconds'], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the connect four engine.")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="compare against results saved from an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="slowdown over the baseline counted as a regression (default 0.10)")
+    parser.add_argument('--max-depth', type=int, default=SEARCH_DEPTHS[-1],
+                        help="deepest MinimaxAgent.move benchmark (default %d)" % SEARCH_DEPTHS[-1])
+    parser.add_argument('--games', type=int, default=10, help="games in the mini tournament (default 10)")
+    parser.add_argument('--micro-only', action='store_true', help="skip the search and tournament benchmarks")
+    args = parser.parse_args(argv)
+
+    benchmarks = micro_benchmarks()
+    if not args.micro_only:
+        depths = [depth for depth in SEARCH_DEPTHS if depth <= args.max_depth]
+        benchmarks.update(macro_benchmarks(depths, args.games))
+    results = {'python': platform.python_version(), 'machine': platform.machine(), 'benchmarks': benchmarks}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("%d benchmark(s) regressed by more than %.0f%%" % (len(regressions), args.threshold * 100))
+            return 1
+    else:
+        for name, result in sorted(benchmarks.items()):
+            print("%-40s %12.3e s" % (name, result['seconds']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
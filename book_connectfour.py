@@ -0,0 +1,80 @@
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from minimax_connectfour import COLS, ROWS, Game, MinimaxAgent, OpeningBook
+
+# Search agents of a worker process, kept between positions so their transposition tables carry over
+_agents = {}
+
+
+def positions(plies, rows=ROWS, cols=COLS):
+    """Return every position reached within plies moves of the empty board, red moving first, as a dict of
+    canonical_key to (red, black, mirrored): the bitboards of one position with that key, and whether it is
+    the mirror image of the canonical one. Transpositions and mirror images are kept once; won positions have
+    no book move."""
+    found = {}
+    frontier = [Game([['-' for i in range(cols)] for j in range(rows)])]
+    for ply in range(plies + 1):
+        children = []
+        for game in frontier:
+            key, mirrored = game.canonical_key(ply % 2 == 0)
+            if key in found:
+                continue
+            found[key] = (game.red, game.black, mirrored)
+            if ply == plies:
+                continue
+            for col in game.possible_moves():
+                child = game.neighbor(col, 'RB'[ply % 2])
+                if child.last_move_state() is None:
+                    children.append(child)
+        frontier = children
+    return found
+
+
+def best_move(red, black, rows, cols, depth, table_size):
+    """Worker job: return the best column for the side to move, found by a depth-ply search."""
+    game = Game.from_bitboards(red, black, rows, cols)
+    color = 'RB'[game.move_count % 2]
+    key = (color, depth, table_size)
+    if key not in _agents:
+        _agents[key] = MinimaxAgent(color, depth=depth, table_size=table_size)
+    return _agents[key].move(game)
+
+
+def build(path, plies, depth, workers=1, table_size=1 << 20, rows=ROWS, cols=COLS):
+    """Search every position up to plies moves in to depth, and write the best moves to a book at path."""
+    found = positions(plies, rows, cols)
+    keys = list(found)
+    jobs = ([found[key][0] for key in keys], [found[key][1] for key in keys], [rows] * len(keys),
+            [cols] * len(keys), [depth] * len(keys), [table_size] * len(keys))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            cols_played = list(executor.map(best_move, *jobs, chunksize=16))
+    else:
+        cols_played = list(map(best_move, *jobs))
+    # The book keeps moves for the canonical orientation
+    moves = {key: cols - 1 - col if found[key][2] else col for key, col in zip(keys, cols_played)}
+    OpeningBook.write(path, moves, rows, cols, plies)
+    return len(keys)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build an opening book for the connect four engine.")
+    parser.add_argument('output', help="book file to write")
+    parser.add_argument('--plies', type=int, default=4, help="cover positions up to this many moves in (default 4)")
+    parser.add_argument('--depth', type=int, default=10, help="search depth for each position (default 10)")
+    parser.add_argument('--workers', type=int, default=1, help="search positions in this many processes")
+    parser.add_argument('--rows', type=int, default=ROWS, help="board rows (default %d)" % ROWS)
+    parser.add_argument('--cols', type=int, default=COLS, help="board columns (default %d)" % COLS)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    size = build(args.output, args.plies, args.depth, args.workers, rows=args.rows, cols=args.cols)
+    print("%d positions searched to depth %d in %.1fs" % (size, args.depth, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
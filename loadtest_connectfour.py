@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+
+async def player(host, port, games, depth, rng, latencies, errors):
+    """Play games against the server as one client making random moves, recording the seconds each move
+    request takes."""
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def request(message):
+        writer.write(json.dumps(message).encode() + b'\n')
+        await writer.drain()
+        return json.loads(await reader.readline())
+
+    try:
+        for i in range(games):
+            color = rng.choice('RB')
+            reply = await request({'op': 'new', 'color': color, 'depth': depth})
+            if not reply['ok']:
+                errors.append(reply['error'])
+                continue
+            game = reply['game']
+            while reply['state'] is None:
+                # A column is open while its top row is empty
+                col = rng.choice([j for j, mark in enumerate(reply['board'][0]) if mark == '-'])
+                start = time.perf_counter()
+                reply = await request({'op': 'move', 'game': game, 'col': col})
+                if not reply['ok']:
+                    errors.append(reply['error'])
+                    break
+                latencies.append(time.perf_counter() - start)
+            await request({'op': 'close', 'game': game})
+    finally:
+        writer.close()
+
+
+def percentile(values, p):
+    """Return the p-th percentile of sorted values, by nearest rank."""
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+async def load_test(host, port, players, games, depth, seed):
+    latencies, errors = [], []
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    await asyncio.gather(*(player(host, port, games, depth, random.Random(rng.random()), latencies, errors)
+                           for i in range(players)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test a connect four game server.")
+    parser.add_argument('--host', default='127.0.0.1', help="server address (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="server port (default 8765)")
+    parser.add_argument('--players', type=int, default=100, help="concurrent clients (default 100)")
+    parser.add_argument('--games', type=int, default=1, help="games each client plays (default 1)")
+    parser.add_argument('--depth', type=int, default=4, help="engine search depth (default 4)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the clients' moves (default 0)")
+    args = parser.parse_args(argv)
+
+    latencies, errors, seconds = asyncio.run(
+        load_test(args.host, args.port, args.players, args.games, args.depth, args.seed))
+    latencies.sort()
+    print("%d moves in %.1fs (%.0f moves/s), %d errors" % (
+        len(latencies), seconds, len(latencies) / seconds, len(errors)))
+    if latencies:
+        print("move latency: " + ' '.join("p%d %.1fms" % (p, percentile(latencies, p) * 1000)
+                                          for p in (50, 90, 95, 99)) + " max %.1fms" % (latencies[-1] * 1000))
+    for error in sorted(set(errors)):
+        print("%d x %s" % (errors.count(error), error))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
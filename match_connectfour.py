@@ -0,0 +1,260 @@
+import argparse
+import ast
+import functools
+import itertools
+import math
+import random
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from minimax_connectfour import COLS, ROWS, FirstMoveAgent, Game, MCTSAgent, MinimaxAgent, RandomAgent
+
+# Agents a command line spec can name
+AGENTS = {'minimax': MinimaxAgent, 'mcts': MCTSAgent, 'random': RandomAgent, 'first': FirstMoveAgent}
+# Scores of a game for the agent playing red
+RED_SCORES = {float('inf'): 1.0, 0: 0.5, float('-inf'): 0.0}
+
+
+def agent_factory(spec):
+    """Return something that makes the agent a spec names when called with its colour. A spec is an agent name
+    with optional keyword arguments, as in "minimax:depth=6,time_limit=0.5"; values are Python literals, or
+    taken as strings if they are not."""
+    name, _, options = spec.partition(':')
+    if name not in AGENTS:
+        raise ValueError("unknown agent %r, expected one of %s" % (name, ', '.join(sorted(AGENTS))))
+    kwargs = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        try:
+            kwargs[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            kwargs[key] = value
+    return functools.partial(AGENTS[name], **kwargs)
+
+
+def expected_score(elo):
+    """Return the score per game expected of a player elo points stronger than the opponent."""
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def elo(score):
+    """Return the Elo difference that a score per game between 0 and 1 stands for."""
+    if score <= 0:
+        return float('-inf')
+    if score >= 1:
+        return float('inf')
+    return 400 * math.log10(score / (1 - score))
+
+
+class MatchStats(object):
+    """Results of a match between two agents, played as pairs of games on one opening with colours swapped.
+
+    Game pairs are counted by their total score for the first agent, 0 to 2 in halves. Scoring pairs rather
+    than games takes out most of the luck of the opening, which narrows the error bars and lets the
+    sequential test stop sooner."""
+
+    def __init__(self):
+        self.pairs = [0] * 5
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+    def add(self, scores):
+        """Count a pair of game scores for the first agent."""
+        for score in scores:
+            if score == 1:
+                self.wins += 1
+            elif score == 0:
+                self.losses += 1
+            else:
+                self.draws += 1
+        self.pairs[int(sum(scores) * 2)] += 1
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def score(self):
+        """Return the mean score per game of the first agent, and the variance of its mean over a pair."""
+        n = sum(self.pairs)
+        mean = sum(k / 4 * count for k, count in enumerate(self.pairs)) / n
+        variance = sum((k / 4 - mean) ** 2 * count for k, count in enumerate(self.pairs)) / n
+        return mean, variance
+
+    def elo(self, z=1.96):
+        """Return the Elo difference of the first agent with the ends of its confidence interval, 95% by
+        default."""
+        mean, variance = self.score()
+        margin = z * math.sqrt(variance / sum(self.pairs))
+        return elo(mean), elo(mean - margin), elo(mean + margin)
+
+    def llr(self, elo0, elo1):
+        """Return the log likelihood ratio of the first agent being elo1 rather than elo0 points stronger,
+        by the normal approximation of the generalized sequential probability ratio test."""
+        mean, variance = self.score()
+        # One-sided results leave no spread to measure; a small floor keeps the ratio finite
+        variance = max(variance, 1e-4)
+        s0, s1 = expected_score(elo0), expected_score(elo1)
+        return sum(self.pairs) * (s1 - s0) * (2 * mean - s0 - s1) / (2 * variance)
+
+    def summary(self):
+        """Return the results as a short printable line."""
+        value, low, high = self.elo()
+        return "%d games: +%d =%d -%d, pairs %s, Elo %+.1f (95%% %+.1f to %+.1f)" % (
+            self.games, self.wins, self.draws, self.losses, '/'.join(map(str, self.pairs)), value, low, high)
+
+
+def opening(rng, plies, rows=ROWS, cols=COLS):
+    """Return the columns of a random opening of plies moves, red moving first, that leaves the game open."""
+    while True:
+        game = Game([['-' for i in range(cols)] for j in range(rows)])
+        moves = []
+        for ply in range(plies):
+            col = rng.choice(game.possible_moves())
+            game.make_move(col, 'RB'[ply % 2])
+            moves.append(col)
+            if game.last_move_state() is not None:
+                break
+        else:
+            return moves
+
+
+def play_game(red, black, moves, seed, rows=ROWS, cols=COLS):
+    """Play one game between the agents red and black make, from the opening moves, and return its
+    last_move_state(). Agents that draw random moves share one stream seeded with seed."""
+    game = Game([['-' for i in range(cols)] for j in range(rows)])
+    for ply, col in enumerate(moves):
+        game.make_move(col, 'RB'[ply % 2])
+    players = {'R': red('R'), 'B': black('B')}
+    rng = random.Random(seed)
+    for player in players.values():
+        if hasattr(player, 'rng'):
+            player.rng = rng
+    try:
+        while True:
+            color = 'RB'[game.move_count % 2]
+            game = game.neighbor(players[color].move(game), color)
+            state = game.last_move_state()
+            if state is not None:
+                return state
+    finally:
+        for player in players.values():
+            if hasattr(player, 'close'):
+                player.close()
+
+
+def play_pair(first, second, seed, plies, rows=ROWS, cols=COLS):
+    """Worker job: play a random opening, picked by seed, twice, once with first as red and once with it as
+    black. Return the scores of first in the two games."""
+    moves = opening(random.Random(seed), plies, rows, cols)
+    return (RED_SCORES[play_game(first, second, moves, seed, rows, cols)],
+            1 - RED_SCORES[play_game(second, first, moves, seed, rows, cols)])
+
+
+def match(first, second, max_pairs=500, elo0=0.0, elo1=30.0, alpha=0.05, beta=0.05, min_pairs=10, plies=4,
+          seed=0, workers=1, sprt=True, log=print):
+    """Play pairs of games between the agents first and second make until a sequential probability ratio test
+    decides between first being elo0 and elo1 points stronger, with error rates alpha and beta, or max_pairs
+    pairs are played. With sprt false, every pair is played. Pair i opens with a random opening of plies moves
+    picked by seed + i, so the same seed plays the same openings for any pair of agents; workers > 1 plays
+    pairs in that many processes. Each result is passed to log as it comes in.
+
+    Return the MatchStats and the verdict: 'H1' if first is the stronger by elo1, 'H0' if not by more than
+    elo0, None if the test did not finish."""
+    lower, upper = math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+    stats = MatchStats()
+    verdict = None
+    seeds = iter(range(seed, seed + max_pairs))
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if executor is None:
+            results = (play_pair(first, second, pair_seed, plies) for pair_seed in seeds)
+        else:
+            results = pool_results(executor, play_pair, first, second, seeds, plies, 2 * workers)
+        for scores in results:
+            stats.add(scores)
+            llr = stats.llr(elo0, elo1)
+            log("pair %d: %.1f-%.1f  %s  LLR %.2f (%.2f, %.2f)" % (
+                sum(stats.pairs), sum(scores), 2 - sum(scores), stats.summary(), llr, lower, upper))
+            if sprt and sum(stats.pairs) >= min_pairs:
+                if llr >= upper:
+                    verdict = 'H1'
+                elif llr <= lower:
+                    verdict = 'H0'
+                if verdict is not None:
+                    break
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return stats, verdict
+
+
+def pool_results(executor, job, first, second, seeds, plies, ahead):
+    """Yield the results of job for each seed as they finish, keeping at most ahead jobs queued, so a match
+    that stops early has little work left to cancel."""
+    pending = {executor.submit(job, first, second, pair_seed, plies) for pair_seed in itertools.islice(seeds, ahead)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            for pair_seed in itertools.islice(seeds, 1):
+                pending.add(executor.submit(job, first, second, pair_seed, plies))
+            yield future.result()
+
+
+def round_robin(specs, log=print, **options):
+    """Play a match, as match takes options for, between every two agents of specs, and return the standings:
+    a list of (points, games, spec), best first."""
+    points = dict.fromkeys(specs, 0.0)
+    games = dict.fromkeys(specs, 0)
+    for a, b in itertools.combinations(specs, 2):
+        stats, verdict = match(agent_factory(a), agent_factory(b), log=lambda line: None, **options)
+        log("%s vs %s: %s%s" % (a, b, stats.summary(), '' if verdict is None else ', ' + verdict))
+        score = stats.wins + stats.draws / 2
+        points[a] += score
+        points[b] += stats.games - score
+        games[a] += stats.games
+        games[b] += stats.games
+    return sorted(((points[spec], games[spec], spec) for spec in specs), reverse=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play connect four agents against each other until a "
+                                                 "sequential probability ratio test decides which is stronger.")
+    parser.add_argument('agents', nargs='+', help="agents to play, as name[:key=value,...] with name one of "
+                                                  "%s; with more than two, a round robin" % ', '.join(sorted(AGENTS)))
+    parser.add_argument('--max-pairs', type=int, default=500, help="most game pairs per match (default 500)")
+    parser.add_argument('--elo0', type=float, default=0.0, help="Elo difference of the null hypothesis (default 0)")
+    parser.add_argument('--elo1', type=float, default=30.0, help="Elo difference of the alternative (default 30)")
+    parser.add_argument('--alpha', type=float, default=0.05, help="false positive rate (default 0.05)")
+    parser.add_argument('--beta', type=float, default=0.05, help="false negative rate (default 0.05)")
+    parser.add_argument('--min-pairs', type=int, default=10, help="pairs before the test may stop (default 10)")
+    parser.add_argument('--fixed', action='store_true', help="play every pair instead of stopping early")
+    parser.add_argument('--plies', type=int, default=4, help="moves in each random opening (default 4)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first opening (default 0)")
+    parser.add_argument('--workers', type=int, default=1, help="play pairs in this many processes")
+    args = parser.parse_args(argv)
+    if len(args.agents) < 2:
+        parser.error("need at least two agents")
+    try:
+        factories = [agent_factory(spec) for spec in args.agents]
+    except ValueError as e:
+        parser.error(str(e))
+
+    options = dict(max_pairs=args.max_pairs, elo0=args.elo0, elo1=args.elo1, alpha=args.alpha, beta=args.beta,
+                   min_pairs=args.min_pairs, plies=args.plies, seed=args.seed, workers=args.workers,
+                   sprt=not args.fixed)
+    if len(args.agents) == 2:
+        stats, verdict = match(*factories, log=lambda line: print(line, flush=True), **options)
+        print("%s vs %s: %s" % (args.agents[0], args.agents[1], stats.summary()))
+        print({'H1': "H1 accepted: %s is stronger" % args.agents[0],
+               'H0': "H0 accepted: %s is not stronger" % args.agents[0],
+               None: "no decision"}[verdict])
+    else:
+        standings = round_robin(args.agents, log=lambda line: print(line, flush=True), **options)
+        for points, games, spec in standings:
+            print("%-40s %6.1f / %d" % (spec, points, games))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
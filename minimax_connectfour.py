@@ -1,16 +1,222 @@
 import abc
-import copy
+import argparse
+import array
+import cProfile
 import math
+import mmap
+import os
+import pstats
+import struct
+import sys
+import threading
 import time
+import tracemalloc
 import random
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from multiprocessing import RawValue, shared_memory
+
+try:
+    import numpy as np
+except ImportError:  # Only batch evaluation needs numpy
+    np = None
+
+
+# Size of the standard board single_game() and tournament() play on
+ROWS = 8
+COLS = 8
+# Line directions as (column step, row step): vertical, horizontal, + slope and - slope diagonal
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+# Score for a run of exactly this many pieces in a row
+RUN_SCORES = {2: 10, 3: 50, 4: 100}
+# Move ordering heuristics MinimaxAgent can use: the transposition table's or previous iteration's best move,
+# killer moves per ply, the history table, and center-first static order
+ORDERINGS = ('table', 'killers', 'history', 'center')
+# Search value of a won position, before the bonus that makes the search prefer quicker wins
+WIN_SCORE = 1000000
+# Values at least this large either way are forced wins or losses, never heuristic scores
+WIN_BOUND = WIN_SCORE // 2
+# MinimaxAgent solves positions with this many empty cells or fewer to the end of the game
+ENDGAME_CELLS = 16
+# Half-width of the aspiration window each iteration of MinimaxAgent's search starts with, around the score of
+# the iteration before
+ASPIRATION_WINDOW = 100
+# Opening book file layout: a header of magic, version, board rows and columns, plies covered and record
+# count, then one record per position, sorted by key: the position's canonical_key and the best column to play
+# in the canonical orientation
+BOOK_MAGIC = b'C4BK'
+BOOK_HEADER = struct.Struct('<4sBBBBQ')
+BOOK_RECORD = struct.Struct('<QB')
+
+
+class Geometry(object):
+    """Lookup tables for one board size, built once and shared by every Game of that size.
+
+    A board is kept as one bitboard per colour: bit (col * rows + row) is set when that colour has a piece in
+    the cell, with row 0 at the bottom of the column. The 8x8 board fits exactly in a 64-bit integer per colour."""
+
+    _cache = {}
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.cells = rows * cols
+        self.column = (1 << rows) - 1
+        # The bottom and the top cell of every column
+        self.bottom = sum(1 << (col * rows) for col in range(cols))
+        self.top = self.bottom << (rows - 1)
+        # Every four-cell window of the board, as its cells and as a bitboard
+        self.window_cells = []
+        # For each direction, the bit shift from one cell of a window to the next and the bitboard of the cells
+        # windows start from, for finding the cells that complete a four (see Game.winning_cells)
+        self.window_shifts = []
+        for dcol, drow in DIRECTIONS:
+            starts = 0
+            for col in range(cols):
+                for row in range(rows):
+                    # Skip windows that run off the board
+                    if 0 <= col + 3 * dcol < cols and 0 <= row + 3 * drow < rows:
+                        self.window_cells.append(tuple((col + k * dcol) * rows + row + k * drow for k in range(4)))
+                        starts |= 1 << (col * rows + row)
+            shift = dcol * rows + drow
+            self.window_shifts.append((shift, 2 * shift, 3 * shift, starts))
+        self.windows = [sum(1 << cell for cell in cells) for cells in self.window_cells]
+        # For every cell, the indexes of the windows through it
+        cell_windows = [[] for cell in range(self.cells)]
+        for w, cells in enumerate(self.window_cells):
+            for cell in cells:
+                cell_windows[cell].append(w)
+        self.cell_windows = [tuple(indexes) for indexes in cell_windows]
+        # Every line across the board along each direction as its cells in order, and for every cell the bits of
+        # the cells stepping away from it backwards and forwards along each direction, to measure runs with
+        self.lines = []
+        self.rays = [[] for cell in range(self.cells)]
+        for dcol, drow in DIRECTIONS:
+            for col in range(cols):
+                for row in range(rows):
+                    # A line starts where the step back leaves the board
+                    if not (0 <= col - dcol < cols and 0 <= row - drow < rows):
+                        line = []
+                        c, r = col, row
+                        while 0 <= c < cols and 0 <= r < rows:
+                            line.append(c * rows + r)
+                            c, r = c + dcol, r + drow
+                        self.lines.append(tuple(line))
+                        for k, cell in enumerate(line):
+                            self.rays[cell].append((tuple(1 << c for c in reversed(line[:k])),
+                                                    tuple(1 << c for c in line[k + 1:])))
+        # Score of a run of every length a line can hold
+        self.run_scores = [RUN_SCORES.get(k, 0) for k in range(max(rows, cols) + 1)]
+        # Random keys for Zobrist hashing: one per colour and cell, plus one for red to move. The fixed seed keeps
+        # hashes the same from run to run and process to process; folding the board size into it gives every size
+        # its own keys, so positions of different sizes do not share hashes
+        rng = random.Random((2024 << 16) | rows << 8 | cols)
+        self.zobrist = {color: [rng.getrandbits(64) for cell in range(self.cells)] for color in 'RB'}
+        self.zobrist_red_to_move = rng.getrandbits(64)
+        # The keys of each cell's mirror image across the middle column, for the hash of the mirrored board
+        mirror = [(cols - 1 - cell // rows) * rows + cell % rows for cell in range(self.cells)]
+        self.zobrist_mirror = {color: [keys[mirror[cell]] for cell in range(self.cells)]
+                               for color, keys in self.zobrist.items()}
+        # Columns from the middle outwards, the static move order; a center piece sits in the most windows
+        self.center_order = sorted(range(cols), key=lambda col: abs(2 * col - (cols - 1)))
+        self.center_rank = [self.center_order.index(col) for col in range(cols)]
+
+    @classmethod
+    def of(cls, rows, cols):
+        """Return the shared Geometry for a board size."""
+        if (rows, cols) not in cls._cache:
+            cls._cache[rows, cols] = cls(rows, cols)
+        return cls._cache[rows, cols]
 
 
 class Game(object):
     """A connect four game."""
 
+    # When set, utility() checks the incrementally kept score against a full recompute of redscore() and
+    # blackscore()
+    debug = False
+
     def __init__(self, grid):
-        """Instances differ by their board."""
-        self.grid = copy.deepcopy(grid)  # No aliasing!
+        """Instances differ by their board. The grid, top row first, also sets the board size."""
+        self.geometry = Geometry.of(len(grid), len(grid[0]))
+        rows = self.geometry.rows
+        # Pack the grid into the two bitboards
+        self.red = 0
+        self.black = 0
+        for i, row in enumerate(grid):
+            for j, mark in enumerate(row):
+                bit = 1 << (j * rows + rows - 1 - i)
+                if mark == 'R':
+                    self.red |= bit
+                elif mark == 'B':
+                    self.black |= bit
+        self._count_heights()
+
+    @classmethod
+    def from_bitboards(cls, red, black, rows=ROWS, cols=COLS):
+        """Return a Game built directly from a pair of bitboards, skipping the grid."""
+        game = cls.__new__(cls)
+        game.geometry = Geometry.of(rows, cols)
+        game.red = red
+        game.black = black
+        game._count_heights()
+        return game
+
+    def _count_heights(self):
+        """Work out how many pieces each column holds."""
+        geometry = self.geometry
+        # Pieces stack from the bottom, so the height of a column is the bit length of its occupied cells
+        occupied = self.red | self.black
+        self.heights = [((occupied >> (col * geometry.rows)) & geometry.column).bit_length()
+                        for col in range(geometry.cols)]
+        self.move_count = sum(self.heights)
+        # Columns played through make_move, most recent last
+        self.history = []
+        # Pieces of each colour in every window, for spotting fours and threats, and the running utility;
+        # make_move and unmake_move keep both up to date
+        self.red_counts = [bin(self.red & window).count('1') for window in geometry.windows]
+        self.black_counts = [bin(self.black & window).count('1') for window in geometry.windows]
+        self.score = self.redscore() - self.blackscore()
+        # Zobrist hash of the pieces on the board and of its mirror image, kept up to date by make_move and
+        # unmake_move
+        self.hash = 0
+        self.mirror_hash = 0
+        for cell in range(geometry.cells):
+            if self.red >> cell & 1:
+                self.hash ^= geometry.zobrist['R'][cell]
+                self.mirror_hash ^= geometry.zobrist_mirror['R'][cell]
+            elif self.black >> cell & 1:
+                self.hash ^= geometry.zobrist['B'][cell]
+                self.mirror_hash ^= geometry.zobrist_mirror['B'][cell]
+
+    def copy(self):
+        """Return an independent copy of this game."""
+        game = Game.__new__(Game)
+        game.geometry = self.geometry
+        game.red = self.red
+        game.black = self.black
+        game.heights = list(self.heights)
+        game.move_count = self.move_count
+        game.history = list(self.history)
+        game.red_counts = list(self.red_counts)
+        game.black_counts = list(self.black_counts)
+        game.score = self.score
+        game.hash = self.hash
+        game.mirror_hash = self.mirror_hash
+        return game
+
+    @property
+    def grid(self):
+        """The board as a list of rows of 'R', 'B' and '-' marks, top row first."""
+        rows, cols = self.geometry.rows, self.geometry.cols
+        grid = [['-' for j in range(cols)] for i in range(rows)]
+        for i in range(rows):
+            for j in range(cols):
+                bit = 1 << (j * rows + rows - 1 - i)
+                if self.red & bit:
+                    grid[i][j] = 'R'
+                elif self.black & bit:
+                    grid[i][j] = 'B'
+        return grid
 
     def display(self):
         """Print the game board."""
@@ -22,535 +228,594 @@ class Game(object):
 
     def possible_moves(self):
         """Return a list of possible moves given the current board."""
-        # Define possible moves as an empty list
-        posmvs = list()
-
-        # Iterate through grid and check for open spaces that a piece can be dropped into
-        for j in range(8):
-            for i in range(8):
-                # Can drop piece if the top of the column has a blank space
-                if self.grid[i][j] == '-':
-                    posmvs.append(j)
-                    break
-        # Returns list of free columns to drop into
-        return posmvs
+        # A piece can be dropped into any column that is not full yet
+        rows = self.geometry.rows
+        return [j for j, height in enumerate(self.heights) if height < rows]
 
     def neighbor(self, col, color):
         """Return a Game instance like this one but with a move made into the specified column."""
-        # Drops piece into chosen column until it either hits bottom or another piece, replacing blank space
-        neighbor = Game(self.grid)
-
-        for i in range(7):
-            for j in range(7):
-                # Places piece if empty column
-                if j == col and self.grid[i][j] == '-' and i + 1 == 7 and self.grid[i + 1][j] == '-':
-                    neighbor.grid[i + 1][j] = color
-                # Places piece if there is a piece below it
-                elif j == col and self.grid[i][j] == '-' and (self.grid[i + 1][j] == 'R' or self.grid[i + 1][j] == 'B'):
-                    neighbor.grid[i][j] = color
+        neighbor = self.copy()
+        # A full column leaves the board unchanged
+        if self.heights[col] < self.geometry.rows:
+            neighbor.make_move(col, color)
         # Returns instance of Game with move made
         return neighbor
 
+    def make_move(self, col, color):
+        """Drop a piece of the given color into a column of this board, in place."""
+        geometry = self.geometry
+        height = self.heights[col]
+        if height >= geometry.rows:
+            raise ValueError("column %d is full" % col)
+        cell = col * geometry.rows + height
+        if color == 'R':
+            self.red |= 1 << cell
+            mine = self.red_counts
+        else:
+            self.black |= 1 << cell
+            mine = self.black_counts
+        self.heights[col] = height + 1
+        self.move_count += 1
+        self.history.append(col)
+        self.hash ^= geometry.zobrist[color][cell]
+        self.mirror_hash ^= geometry.zobrist_mirror[color][cell]
+        for w in geometry.cell_windows[cell]:
+            mine[w] += 1
+        # Only the runs the new piece joins change score
+        if color == 'R':
+            self.score += self.run_delta(self.red, cell)
+        else:
+            self.score -= self.run_delta(self.black, cell)
+
+    def unmake_move(self, col):
+        """Take the top piece back out of a column, undoing make_move. Moves are taken back last made first, so
+        col has to be the column of the latest move still made."""
+        # Taking back any other piece would leave the history out of step with the board
+        if not self.history or self.history[-1] != col:
+            raise ValueError("column %d does not hold the last move made" % col)
+        geometry = self.geometry
+        height = self.heights[col] - 1
+        cell = col * geometry.rows + height
+        if self.red & (1 << cell):
+            self.red &= ~(1 << cell)
+            self.hash ^= geometry.zobrist['R'][cell]
+            self.mirror_hash ^= geometry.zobrist_mirror['R'][cell]
+            self.score -= self.run_delta(self.red, cell)
+            mine = self.red_counts
+        else:
+            self.black &= ~(1 << cell)
+            self.hash ^= geometry.zobrist['B'][cell]
+            self.mirror_hash ^= geometry.zobrist_mirror['B'][cell]
+            self.score += self.run_delta(self.black, cell)
+            mine = self.black_counts
+        self.heights[col] = height
+        self.move_count -= 1
+        self.history.pop()
+        for w in geometry.cell_windows[cell]:
+            mine[w] -= 1
+
+    def run_delta(self, board, cell):
+        """Return how much the score of a bitboard's runs goes up when a piece is added at cell, joining the runs
+        on either side of it in every direction."""
+        run_scores = self.geometry.run_scores
+        delta = 0
+        for back, forward in self.geometry.rays[cell]:
+            before = 0
+            for bit in back:
+                if not board & bit:
+                    break
+                before += 1
+            after = 0
+            for bit in forward:
+                if not board & bit:
+                    break
+                after += 1
+            delta += run_scores[before + after + 1] - run_scores[before] - run_scores[after]
+        return delta
+
+    def search_key(self, red_to_move):
+        """Return the hash of this position with the side to move folded in."""
+        return self.hash ^ self.geometry.zobrist_red_to_move if red_to_move else self.hash
+
+    def canonical_key(self, red_to_move):
+        """Return the smaller search_key of this position and of its mirror image, which the two share, and
+        whether it is the mirror image's. Moves stored under the key map across with mirror_col."""
+        key, mirrored = self.hash, self.mirror_hash
+        if red_to_move:
+            key ^= self.geometry.zobrist_red_to_move
+            mirrored ^= self.geometry.zobrist_red_to_move
+        if mirrored < key:
+            return mirrored, True
+        return key, False
+
+    def mirror_col(self, col):
+        """Return the column col becomes when the board is mirrored left to right."""
+        return self.geometry.cols - 1 - col
+
     def utility(self):
         """Return the minimax utility value of this game"""
-        # Calculate number of pieces in a row red has and add together associated scores
-        rscore = self.redscore()
-        # Calculate number of pieces in a row black has and add together associated scores
-        bscore = self.blackscore()
-        # Subtract black score from red score to get final utility
-        h = rscore - bscore
-        return h
+        # The score is kept up to date move by move, so this is a lookup
+        if Game.debug:
+            full = self.redscore() - self.blackscore()
+            if full != self.score:
+                raise AssertionError("incremental score %d does not match full score %d" % (self.score, full))
+        return self.score
 
-    def redscore(self):
+    def runscore(self, board):
+        """Score the runs of exactly 2, 3 and 4 consecutive pieces on a bitboard, in every direction."""
+        run_scores = self.geometry.run_scores
         score = 0
-        # Check horizontal consecutive pieces
-        # 2 consecutive pieces: +10 to score
-        for i in range(8):
-            for j in range(7):
-                # Edge pieces
-                if j == 0:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] != 'R':
-                        score += 10
-                elif j == 6:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j-1] != 'R':
-                        score += 10
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j-1] != 'R' and self.grid[i][j+2] != 'R':
-                        score += 10
-        # 3 consecutive pieces: +50 to score
-        for i in range(8):
-            for j in range(6):
-                # Edge pieces
-                if j == 0:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] == 'R' and self.grid[i][j+3] != 'R':
-                        score += 50
-                elif j == 5:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] == 'R' and self.grid[i][j-1] != 'R':
-                        score += 50
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] == 'R' and self.grid[i][j+3] != 'R' and self.grid[i][j-1] != 'R':
-                        score += 50
-        # 4 consecutive pieces: +100 to score
-        for i in range(8):
-            for j in range(5):
-                # Edge pieces
-                if j == 0:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] == 'R' and self.grid[i][j+3] == 'R' and self.grid[i][j+4] != 'R':
-                        score += 50
-                elif j == 4:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] == 'R' and self.grid[i][j+3] == 'R' and self.grid[i][j-1] != 'R':
-                        score += 50
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] == 'R' and self.grid[i][j+3] == 'R' and self.grid[i][j+4] != 'R' and self.grid[i][j-1] != 'R':
-                        score += 50
-        # Check vertical consecutive pieces
-        # 2 consecutive pieces: +10 to score
-        for j in range(8):
-            for i in range(7):
-                # Edge pieces
-                if i == 0:
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j] == 'R' and self.grid[i + 2][j] != 'R':
-                        score += 10
-                elif i == 6:
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j] == 'R' and self.grid[i - 1][j] != 'R':
-                        score += 10
-                # Non-edge pieces
+        for line in self.geometry.lines:
+            run = 0
+            for cell in line:
+                if board >> cell & 1:
+                    run += 1
                 else:
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j] == 'R' and self.grid[i - 1][j] != 'R' and self.grid[i + 2][j] != 'R':
-                        score += 10
-        # 3 consecutive pieces: +50 to score
-        for i in range(8):
-            for j in range(6):
-                # Edge pieces
-                if j == 0:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] == 'R' and self.grid[i][j+3] != 'R':
-                        score += 50
-                elif j == 5:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] == 'R' and self.grid[i][j-1] != 'R':
-                        score += 50
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] == 'R' and self.grid[i][j+3] != 'R' and self.grid[i][j-1] != 'R':
-                        score += 50
-        # 4 consecutive pieces: +100 to score
-        for j in range(8):
-            for i in range(5):
-                # Edge pieces
-                if i == 0:
-                    if self.grid[i][j] == 'R' and self.grid[i+1][j] == 'R' and self.grid[i+2][j] == 'R' and self.grid[i+3][j] == 'R' and self.grid[i+4][j] != 'R':
-                        score += 50
-                elif i == 4:
-                    if self.grid[i][j] == 'R' and self.grid[i+1][j] == 'R' and self.grid[i+2][j] == 'R' and self.grid[i+3][j] == 'R' and self.grid[i-1][j] != 'R':
-                        score += 50
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'R' and self.grid[i+1][j] == 'R' and self.grid[i+2][j] == 'R' and self.grid[i+3][j] == 'R' \
-                            and self.grid[i+4][j] != 'R' and self.grid[i-1][j] != 'R':
-                        score += 50
-        # Check + slope diagonal consecutive pieces
-        # 2 consecutive pieces: +10 to score
-        for j in range(0, 7):
-            for i in range(1, 8):
-                # "Edge" pieces
-                if (i == 1 and j == 0) or (i == 7 and j == 6):
-                    if self.grid[i][j] == 'R' and self.grid[i - 1][j + 1] == 'R':
-                        score += 10
-                elif (i == 1 and 1 <= j <= 6) or (1 <= i <= 6 and j == 6):
-                    if self.grid[i][j] == 'R' and self.grid[i-1][j+1] == 'R' and self.grid[i+1][j-1] != 'R':
-                        score += 10
-                elif (2 <= i <= 7 and j == 0) or (i == 7 and 0 <= j <= 5):
-                    if self.grid[i][j] == 'R' and self.grid[i-1][j+1] == 'R' and self.grid[i-2][j+2] != 'R':
-                        score += 10
-                # Non-edge pieces
-                elif 2 <= i <= 6 and 1 <= j <= 5:
-                    if self.grid[i][j] == 'R' and self.grid[i-1][j+1] == 'R' and self.grid[i-2][j+2] != 'R' and self.grid[i+1][j-1] != 'R':
-                        score += 10
-        # 3 consecutive pieces: +50 to score
-        for j in range(0, 6):
-            for i in range(2, 8):
-                # "Edge" pieces
-                if (i == 2 and j == 0) or (i == 7 and j == 5):
-                    if self.grid[i][j] == 'R' and self.grid[i - 1][j + 1] == 'R' and self.grid[i - 2][j + 2] == 'R':
-                        score += 50
-                elif (i == 2 and 1 <= j <= 5) or (2 <= i <= 6 and j == 5):
-                    if self.grid[i][j] == 'R' and self.grid[i - 1][j + 1] == 'R' and self.grid[i - 2][j + 2] == 'R' and self.grid[i + 1][j - 1] != 'R':
-                        score += 50
-                elif (3 <= i <= 7 and j == 0) or (i == 7 and 0 <= j <= 4):
-                    if self.grid[i][j] == 'R' and self.grid[i - 1][j + 1] == 'R' and self.grid[i - 2][j + 2] == 'R' and self.grid[i - 3][j + 3] != 'R':
-                        score += 50
-                # Non-edge pieces
-                elif 3 <= i <= 6 and 1 <= j <= 4:
-                    if self.grid[i][j] == 'R' and self.grid[i - 1][j + 1] == 'R' and self.grid[i - 2][j + 2] == 'R'\
-                            and self.grid[i - 3][j + 3] != 'R' and self.grid[i + 1][j - 1] != 'R':
-                        score += 50
-        # 4 consecutive pieces: +100 to score
-        for j in range(0, 5):
-            for i in range(3, 8):
-                # "Edge" pieces
-                if (i == 3 and j == 0) or (i == 7 and j == 4):
-                    if self.grid[i][j] == 'R' and self.grid[i - 1][j + 1] == 'R' and self.grid[i - 2][j + 2] == 'R' and self.grid[i - 3][j + 3] == 'R':
-                        score += 100
-                elif (i == 3 and 1 <= j <= 4) or (3 <= i <= 6 and j == 4):
-                    if self.grid[i][j] == 'R' and self.grid[i - 1][j + 1] == 'R' and self.grid[i - 2][j + 2] == 'R' and self.grid[i - 3][j + 3] == 'R' \
-                            and self.grid[i + 1][j - 1] != 'R':
-                        score += 100
-                elif (4 <= i <= 7 and j == 0) or (i == 7 and 0 <= j <= 3):
-                    if self.grid[i][j] == 'R' and self.grid[i - 1][j + 1] == 'R' and self.grid[i - 2][j + 2] == 'R' and self.grid[i - 3][j + 3] == 'R' \
-                            and self.grid[i - 4][j + 4] != 'R':
-                        score += 100
-                # Non-edge pieces
-                elif 4 <= i <= 6 and 1 <= j <= 3:
-                    if self.grid[i][j] == 'R' and self.grid[i - 1][j + 1] == 'R' and self.grid[i - 2][j + 2] == 'R' and self.grid[i - 3][j + 3] == 'R'\
-                            and self.grid[i - 4][j + 4] != 'R' and self.grid[i + 1][j - 1] != 'R':
-                        score += 100
-        # Check - slope diagonal consecutive pieces
-        # 2 consecutive pieces: +10 to score
-        for j in range(0, 7):
-            for i in range(0, 7):
-                # "Edge" pieces
-                if (i == 6 and j == 0) or (i == 0 and j == 6):
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R':
-                        score += 10
-                elif (i == 0 and 0 <= j <= 5) or (0 <= i <= 5 and j == 0):
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' and self.grid[i + 2][j + 2] != 'R':
-                        score += 10
-                elif (1 <= i <= 6 and j == 6) or (i == 6 and 1 <= j <= 6):
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' and self.grid[i - 1][j - 1] != 'R':
-                        score += 10
-                # Non-edge pieces
-                elif 1 <= i <= 5 and 1 <= j <= 5:
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' \
-                            and self.grid[i + 2][j + 2] != 'R' and self.grid[i - 1][j - 1] != 'R':
-                        score += 10
-        # 3 consecutive pieces: +50 to score
-        for j in range(0, 6):
-            for i in range(0, 6):
-                # "Edge" pieces
-                if (i == 5 and j == 0) or (i == 0 and j == 5):
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' and self.grid[i + 2][j + 2] == 'R':
-                        score += 50
-                elif (i == 0 and 0 <= j <= 4) or (0 <= i <= 4 and j == 0):
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' and self.grid[i + 2][j + 2] == 'R' and self.grid[i + 3][j + 3] != 'R':
-                        score += 50
-                elif (1 <= i <= 5 and j == 5) or (i == 5 and 1 <= j <= 5):
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' and self.grid[i + 2][j + 2] == 'R' and self.grid[i - 1][j - 1] != 'R':
-                        score += 50
-                # Non-edge pieces
-                elif 1 <= i <= 4 and 1 <= j <= 4:
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' and self.grid[i + 2][j + 2] == 'R' \
-                            and self.grid[i + 3][j + 3] != 'R' and self.grid[i - 1][j + 1] != 'R':
-                        score += 50
-        # 4 consecutive pieces: +100 to score
-        for j in range(0, 5):
-            for i in range(3, 8):
-                # "Edge" pieces
-                if (i == 0 and j == 4) or (i == 4 and j == 0):
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' and self.grid[i + 2][j + 2] == 'R' and self.grid[i + 3][j + 3] == 'R':
-                        score += 100
-                elif (i == 0 and 0 <= j <= 3) or (0 <= i <= 3 and j == 0):
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' and self.grid[i + 2][j + 2] == 'R' and self.grid[i + 3][j + 3] == 'R' \
-                            and self.grid[i + 4][j + 4] != 'R':
-                        score += 100
-                elif (1 <= i <= 4 and j == 4) or (i == 4 and 1 <= j <= 4):
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' and self.grid[i + 2][j + 2] == 'R' and self.grid[i + 3][j + 3] == 'R' \
-                            and self.grid[i - 1][j - 1] != 'R':
-                        score += 100
-                # Non-edge pieces
-                elif 1 <= i <= 3 and 1 <= j <= 3:
-                    if self.grid[i][j] == 'R' and self.grid[i + 1][j + 1] == 'R' and self.grid[i + 2][j + 2] == 'R' and self.grid[i + 3][j + 3] == 'R' \
-                            and self.grid[i + 4][j + 4] != 'R' and self.grid[i - 1][j - 1] != 'R':
-                        score += 100
-        # Return final calculated score for red's positions
+                    score += run_scores[run]
+                    run = 0
+            score += run_scores[run]
         return score
 
+    def redscore(self):
+        """Return the score of red's runs of consecutive pieces."""
+        return self.runscore(self.red)
+
     def blackscore(self):
-        score = 0
-        # Check horizontal consecutive pieces
-        # 2 consecutive pieces: +10 to score
-        for i in range(8):
-            for j in range(7):
-                # Edge pieces
-                if j == 0:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j + 2] != 'B':
-                        score += 10
-                elif j == 6:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j - 1] != 'B':
-                        score += 10
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j - 1] != 'B' and \
-                            self.grid[i][j + 2] != 'B':
-                        score += 10
-        # 3 consecutive pieces: +50 to score
-        for i in range(8):
-            for j in range(6):
-                # Edge pieces
-                if j == 0:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j + 2] == 'B' and \
-                            self.grid[i][j + 3] != 'B':
-                        score += 50
-                elif j == 5:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j + 2] == 'B' and \
-                            self.grid[i][j - 1] != 'B':
-                        score += 50
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j + 2] == 'B' and \
-                            self.grid[i][j + 3] != 'B' and self.grid[i][j - 1] != 'B':
-                        score += 50
-        # 4 consecutive pieces: +100 to score
-        for i in range(8):
-            for j in range(5):
-                # Edge pieces
-                if j == 0:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j + 2] == 'B' and \
-                            self.grid[i][j + 3] == 'B' and self.grid[i][j + 4] != 'B':
-                        score += 50
-                elif j == 4:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j + 2] == 'B' and \
-                            self.grid[i][j + 3] == 'B' and self.grid[i][j - 1] != 'B':
-                        score += 50
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j + 2] == 'B' and \
-                            self.grid[i][j + 3] == 'B' and self.grid[i][j + 4] != 'B' and self.grid[i][j - 1] != 'B':
-                        score += 50
-        # Check vertical consecutive pieces
-        # 2 consecutive pieces: +10 to score
-        for j in range(8):
-            for i in range(7):
-                # Edge pieces
-                if i == 0:
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j] == 'B' and self.grid[i + 2][j] != 'B':
-                        score += 10
-                elif i == 6:
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j] == 'B' and self.grid[i - 1][j] != 'B':
-                        score += 10
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j] == 'B' and self.grid[i - 1][j] != 'B' and \
-                            self.grid[i + 2][j] != 'B':
-                        score += 10
-        # 3 consecutive pieces: +50 to score
-        for i in range(8):
-            for j in range(6):
-                # Edge pieces
-                if j == 0:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j + 2] == 'B' and \
-                            self.grid[i][j + 3] != 'B':
-                        score += 50
-                elif j == 5:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j + 2] == 'B' and \
-                            self.grid[i][j - 1] != 'B':
-                        score += 50
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'B' and self.grid[i][j + 1] == 'B' and self.grid[i][j + 2] == 'B' and \
-                            self.grid[i][j + 3] != 'B' and self.grid[i][j - 1] != 'B':
-                        score += 50
-        # 4 consecutive pieces: +100 to score
-        for j in range(8):
-            for i in range(5):
-                # Edge pieces
-                if i == 0:
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j] == 'B' and self.grid[i + 2][j] == 'B' and \
-                            self.grid[i + 3][j] == 'B' and self.grid[i + 4][j] != 'B':
-                        score += 50
-                elif i == 4:
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j] == 'B' and self.grid[i + 2][j] == 'B' and \
-                            self.grid[i + 3][j] == 'B' and self.grid[i - 1][j] != 'B':
-                        score += 50
-                # Non-edge pieces
-                else:
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j] == 'B' and self.grid[i + 2][j] == 'B' and \
-                            self.grid[i + 3][j] == 'B' \
-                            and self.grid[i + 4][j] != 'B' and self.grid[i - 1][j] != 'B':
-                        score += 50
-        # Check + slope diagonal consecutive pieces
-        # 2 consecutive pieces: +10 to score
-        for j in range(0, 7):
-            for i in range(1, 8):
-                # "Edge" pieces
-                if (i == 1 and j == 0) or (i == 7 and j == 6):
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B':
-                        score += 10
-                elif (i == 1 and 1 <= j <= 6) or (1 <= i <= 6 and j == 6):
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i + 1][j - 1] != 'B':
-                        score += 10
-                elif (2 <= i <= 7 and j == 0) or (i == 7 and 0 <= j <= 5):
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i - 2][j + 2] != 'B':
-                        score += 10
-                # Non-edge pieces
-                elif 2 <= i <= 6 and 1 <= j <= 5:
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i - 2][j + 2] != 'B' and \
-                            self.grid[i + 1][j - 1] != 'B':
-                        score += 10
-        # 3 consecutive pieces: +50 to score
-        for j in range(0, 6):
-            for i in range(2, 8):
-                # "Edge" pieces
-                if (i == 2 and j == 0) or (i == 7 and j == 5):
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i - 2][j + 2] == 'B':
-                        score += 50
-                elif (i == 2 and 1 <= j <= 5) or (2 <= i <= 6 and j == 5):
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i - 2][j + 2] == 'B' and \
-                            self.grid[i + 1][j - 1] != 'R':
-                        score += 50
-                elif (3 <= i <= 7 and j == 0) or (i == 7 and 0 <= j <= 4):
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i - 2][j + 2] == 'B' and \
-                            self.grid[i - 3][j + 3] != 'B':
-                        score += 50
-                # Non-edge pieces
-                elif 3 <= i <= 6 and 1 <= j <= 4:
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i - 2][j + 2] == 'B' \
-                            and self.grid[i - 3][j + 3] != 'B' and self.grid[i + 1][j - 1] != 'B':
-                        score += 50
-        # 4 consecutive pieces: +100 to score
-        for j in range(0, 5):
-            for i in range(3, 8):
-                # "Edge" pieces
-                if (i == 3 and j == 0) or (i == 7 and j == 4):
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i - 2][j + 2] == 'B' and \
-                            self.grid[i - 3][j + 3] == 'B':
-                        score += 100
-                elif (i == 3 and 1 <= j <= 4) or (3 <= i <= 6 and j == 4):
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i - 2][j + 2] == 'B' and \
-                            self.grid[i - 3][j + 3] == 'B' \
-                            and self.grid[i + 1][j - 1] != 'B':
-                        score += 100
-                elif (4 <= i <= 7 and j == 0) or (i == 7 and 0 <= j <= 3):
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i - 2][j + 2] == 'B' and \
-                            self.grid[i - 3][j + 3] == 'B' \
-                            and self.grid[i - 4][j + 4] != 'B':
-                        score += 100
-                # Non-edge pieces
-                elif 4 <= i <= 6 and 1 <= j <= 3:
-                    if self.grid[i][j] == 'B' and self.grid[i - 1][j + 1] == 'B' and self.grid[i - 2][j + 2] == 'B' and \
-                            self.grid[i - 3][j + 3] == 'B' \
-                            and self.grid[i - 4][j + 4] != 'B' and self.grid[i + 1][j - 1] != 'B':
-                        score += 100
-        # Check - slope diagonal consecutive pieces
-        # 2 consecutive pieces: +10 to score
-        for j in range(0, 7):
-            for i in range(0, 7):
-                # "Edge" pieces
-                if (i == 6 and j == 0) or (i == 0 and j == 6):
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B':
-                        score += 10
-                elif (i == 0 and 0 <= j <= 5) or (0 <= i <= 5 and j == 0):
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' and self.grid[i + 2][j + 2] != 'B':
-                        score += 10
-                elif (1 <= i <= 6 and j == 6) or (i == 6 and 1 <= j <= 6):
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' and self.grid[i - 1][j - 1] != 'B':
-                        score += 10
-                # Non-edge pieces
-                elif 1 <= i <= 5 and 1 <= j <= 5:
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' \
-                            and self.grid[i + 2][j + 2] != 'B' and self.grid[i - 1][j - 1] != 'B':
-                        score += 10
-        # 3 consecutive pieces: +50 to score
-        for j in range(0, 6):
-            for i in range(0, 6):
-                # "Edge" pieces
-                if (i == 5 and j == 0) or (i == 0 and j == 5):
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' and self.grid[i + 2][j + 2] == 'B':
-                        score += 50
-                elif (i == 0 and 0 <= j <= 4) or (0 <= i <= 4 and j == 0):
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' and self.grid[i + 2][j + 2] == 'B' and \
-                            self.grid[i + 3][j + 3] != 'B':
-                        score += 50
-                elif (1 <= i <= 5 and j == 5) or (i == 5 and 1 <= j <= 5):
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' and self.grid[i + 2][j + 2] == 'B' and \
-                            self.grid[i - 1][j - 1] != 'B':
-                        score += 50
-                # Non-edge pieces
-                elif 1 <= i <= 4 and 1 <= j <= 4:
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' and self.grid[i + 2][j + 2] == 'B' \
-                            and self.grid[i + 3][j + 3] != 'B' and self.grid[i - 1][j + 1] != 'B':
-                        score += 50
-        # 4 consecutive pieces: +100 to score
-        for j in range(0, 5):
-            for i in range(3, 8):
-                # "Edge" pieces
-                if (i == 0 and j == 4) or (i == 4 and j == 0):
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' and self.grid[i + 2][j + 2] == 'B' and \
-                            self.grid[i + 3][j + 3] == 'B':
-                        score += 100
-                elif (i == 0 and 0 <= j <= 3) or (0 <= i <= 3 and j == 0):
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' and self.grid[i + 2][j + 2] == 'B' and \
-                            self.grid[i + 3][j + 3] == 'B' \
-                            and self.grid[i + 4][j + 4] != 'B':
-                        score += 100
-                elif (1 <= i <= 4 and j == 4) or (i == 4 and 1 <= j <= 4):
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' and self.grid[i + 2][j + 2] == 'B' and \
-                            self.grid[i + 3][j + 3] == 'B' \
-                            and self.grid[i - 1][j - 1] != 'B':
-                        score += 100
-                # Non-edge pieces
-                elif 1 <= i <= 3 and 1 <= j <= 3:
-                    if self.grid[i][j] == 'B' and self.grid[i + 1][j + 1] == 'B' and self.grid[i + 2][j + 2] == 'B' and \
-                            self.grid[i + 3][j + 3] == 'B' \
-                            and self.grid[i + 4][j + 4] != 'B' and self.grid[i - 1][j - 1] != 'B':
-                        score += 100
-        # Return final calculated score for red's positions
-        return score
+        """Return the score of black's runs of consecutive pieces."""
+        return self.runscore(self.black)
+
+    def has_four(self, board):
+        """Return True if a bitboard holds four pieces in a row in any direction."""
+        return any(board & window == window for window in self.geometry.windows)
+
+    def top_color(self, col):
+        """Return the color of the top piece in a column."""
+        return 'R' if self.red & (1 << (col * self.geometry.rows + self.heights[col] - 1)) else 'B'
+
+    def is_win_at(self, col):
+        """Return True if the top piece of a column is part of four in a row."""
+        cell = col * self.geometry.rows + self.heights[col] - 1
+        counts = self.red_counts if self.red & (1 << cell) else self.black_counts
+        # Only the windows through the piece can have filled up
+        for w in self.geometry.cell_windows[cell]:
+            if counts[w] == 4:
+                return True
+        return False
+
+    def playable_cells(self):
+        """Return the bitboard of the cells a piece can be dropped into, one per column that is not full."""
+        geometry = self.geometry
+        occupied = self.red | self.black
+        # Adding a column's bottom bit to its stack of pieces carries up into the cell above them; full columns
+        # are left out, or the carry would run on into the next column
+        open_bottoms = geometry.bottom & ~((occupied & geometry.top) >> (geometry.rows - 1))
+        return (occupied + open_bottoms) & ~occupied
+
+    def winning_cells(self, board):
+        """Return the bitboard of the empty cells that would complete four in a row for the pieces of board,
+        whether or not a piece can be dropped into them yet."""
+        cells = 0
+        for shift, shift2, shift3, starts in self.geometry.window_shifts:
+            # Bit x of a board shifted down k steps tells whether the cell k steps on from cell x is taken. A
+            # window starting at x with three of its cells taken is completed by the fourth
+            board1 = board >> shift
+            low = board & board1 & starts
+            high = board >> shift2 & board >> shift3 & starts
+            cells |= (board1 & high | (board & high) << shift
+                      | (low & board >> shift3) << shift2 | (low & board >> shift2) << shift3)
+        return cells & ~(self.red | self.black)
+
+    def threats(self, red_to_move):
+        """Find the threats on the board for the side to move. Returns three bitboards of playable cells:
+        the ones that win at once, the ones the opponent would win with next move and so have to be blocked,
+        and the unplayable ones, which would let the opponent win in the cell above."""
+        geometry = self.geometry
+        mine, theirs = (self.red, self.black) if red_to_move else (self.black, self.red)
+        playable = self.playable_cells()
+        threatened = self.winning_cells(theirs)
+        # The cell above a top cell is the bottom of the next column, not above it
+        return (self.winning_cells(mine) & playable, threatened & playable,
+                threatened >> 1 & playable & ~geometry.top)
+
+    def is_full(self):
+        """Return True if every cell holds a piece."""
+        return self.move_count == self.geometry.cells
+
+    def last_move_state(self):
+        """Like winning_state(), but only looks at the windows through the last piece dropped.
+           Assumes nobody had won before that move."""
+        if not self.history:
+            return self.winning_state()
+        col = self.history[-1]
+        if self.is_win_at(col):
+            return float("inf") if self.top_color(col) == 'R' else float("-inf")
+        if self.is_full():
+            return 0
+        return None
 
     def winning_state(self):
         """Returns float("inf") if Red wins; float("-inf") if Black wins;
            0 if board full; None if not full and no winner"""
-        # Assign infinity and -infinity to variables for readability
-        redw = float("inf")
-        blackw = float("-inf")
-        fullcheck = 0
-
-        # Vertical four-in-a-row check
-        for j in range(8):
-            for i in range(5):
-                # If 4 reds are consecutively in the same column, red wins, likewise for black
-                if self.grid[i][j] == 'R' and self.grid[i+1][j] == 'R' and self.grid[i+2][j] == 'R' and self.grid[i+3][j] == 'R':
-                    return redw
-                elif self.grid[i][j] == 'B' and self.grid[i+1][j] == 'B' and self.grid[i+2][j] == 'B' and self.grid[i+3][j] == 'B':
-                    return blackw
-        # Horizontal four-in-a-row check
-        for i in range(8):
-            for j in range(5):
-                # If 4 reds are consecutively in the same row, red wins, likewise for black
-                if self.grid[i][j] == 'R' and self.grid[i][j+1] == 'R' and self.grid[i][j+2] == 'R' and self.grid[i][j+3] == 'R':
-                    return redw
-                elif self.grid[i][j] == 'B' and self.grid[i][j+1] == 'B' and self.grid[i][j+2] == 'B' and self.grid[i][j+3] == 'B':
-                    return blackw
-        # Positive slope diagonal check
-        for j in range(5):
-            for i in range(3, 8):
-                if self.grid[i][j] == 'R' and self.grid[i-1][j+1] == 'R' and self.grid[i-2][j+2] == 'R' and self.grid[i-3][j+3] == 'R':
-                    return redw
-                elif self.grid[i][j] == 'B' and self.grid[i-1][j+1] == 'B' and self.grid[i-2][j+2] == 'B' and self.grid[i-3][j+3] == 'B':
-                    return blackw
-        # Negative slope diagonal check
-        for j in range(5):
-            for i in range(0, 5):
-                if self.grid[i][j] == 'R' and self.grid[i+1][j+1] == 'R' and self.grid[i+2][j+2] == 'R' and self.grid[i+3][j+3] == 'R':
-                    return redw
-                elif self.grid[i][j] == 'B' and self.grid[i+1][j+1] == 'B' and self.grid[i+2][j+2] == 'B' and self.grid[i+3][j+3] == 'B':
-                    return blackw
+        # A window with four pieces of one colour is a win
+        if 4 in self.red_counts:
+            return float("inf")
+        if 4 in self.black_counts:
+            return float("-inf")
         # Full board check
-        for i in range(8):
-            for j in range(8):
-                # Checks each square and increments counter anytime a piece is found; if 64 pieces are found,
-                # board is full
-                if self.grid[i][j] == 'R' or self.grid[i][j] == 'B':
-                    fullcheck += 1
-                if fullcheck == 64:
-                    return 0
+        if self.is_full():
+            return 0
         # If function hasn't returned a value at this point, we can assume the board is not full and there is no winner
         return None
 
 
+def bitboard_array(games):
+    """Stack the boards of some games into an N x 2 uint64 array of (red, black) bitboards."""
+    return np.array([(game.red, game.black) for game in games], dtype=np.uint64)
+
+
+def batch_evaluate(boards, rows=ROWS, cols=COLS):
+    """Score many boards at once with numpy. Returns (scores, winners): the utility() of every board, and
+    1 where red has four in a row, -1 where black has, 0 otherwise.
+
+    boards is either an N x 2 uint64 array of (red, black) bitboards of rows x cols boards (at most 64
+    cells), or an N x rows x cols int8 array laid out like Game.grid with 1 for red, -1 for black and 0 for
+    empty cells."""
+    if np is None:
+        raise ImportError("batch_evaluate needs numpy")
+    boards = np.asarray(boards)
+    if boards.ndim == 2:
+        geometry = Geometry.of(rows, cols)
+        if geometry.cells > 64:
+            raise ValueError("a %dx%d board does not fit in 64-bit bitboards" % (cols, rows))
+        # Unpack bit (col * rows + row) of each bitboard into the same cell index
+        bits = (boards[:, :, None] >> np.arange(geometry.cells, dtype=np.uint64)) & np.uint64(1)
+        red = bits[:, 0].astype(np.int8)
+        black = bits[:, 1].astype(np.int8)
+    else:
+        geometry = Geometry.of(boards.shape[1], boards.shape[2])
+        # Grid rows run top down; flip and lay the columns end to end to get the bitboard cell order
+        cells = boards[:, ::-1, :].transpose(0, 2, 1).reshape(len(boards), -1)
+        red = (cells == 1).astype(np.int8)
+        black = (cells == -1).astype(np.int8)
+    # Lay every line out as a row of cells, padded at both ends with an extra cell that is always empty, so a
+    # run of exactly k pieces starts wherever an empty cell is followed by k pieces and another empty cell
+    length = max(len(line) for line in geometry.lines)
+    index = np.array([(geometry.cells,) + line + (geometry.cells,) * (length + 1 - len(line))
+                      for line in geometry.lines])
+    scores = np.zeros(len(boards), dtype=np.int64)
+    for color, sign in ((red, 1), (black, -1)):
+        lines = np.concatenate([color, np.zeros((len(boards), 1), dtype=np.int8)], axis=1)[:, index] == 1
+        for k, weight in RUN_SCORES.items():
+            starts = length + 1 - k
+            exact = ~lines[:, :, :starts] & ~lines[:, :, k + 1:k + 1 + starts]
+            for j in range(1, k + 1):
+                exact &= lines[:, :, j:j + starts]
+            scores += sign * weight * exact.sum(axis=(1, 2))
+    # Count each colour's pieces in every window from the window table to find the fours
+    index = np.array(geometry.window_cells)
+    winners = ((red[:, index].sum(axis=2) == 4).any(axis=1).astype(np.int8)
+               - (black[:, index].sum(axis=2) == 4).any(axis=1).astype(np.int8))
+    return scores, winners
+
+
+class TranspositionTable(object):
+    """Fixed-size cache of searched positions, keyed by Zobrist hash.
+
+    Each bucket has two slots: one kept for the deepest search of the positions that share it, and one that
+    always takes the latest store. Memory stays at size entries however long the table is used."""
+
+    # Bound types: the stored value is exact, a lower bound (fail high) or an upper bound (fail low)
+    EXACT, LOWER, UPPER = 0, 1, 2
+
+    def __init__(self, size=1 << 16):
+        """The table holds at most size entries."""
+        self.buckets = max(1, size // 2)
+        self.slots = [None] * (2 * self.buckets)
+
+    def lookup(self, key, layer):
+        """Return (depth, value, bound, col) stored for a key, or None. Win values are adjusted to layer."""
+        i = 2 * (key % self.buckets)
+        for entry in (self.slots[i], self.slots[i + 1]):
+            if entry is not None and entry[0] == key:
+                value = entry[2]
+                # Wins are stored as distance from the stored node; turn that back into a score at this layer
+                if value >= WIN_BOUND:
+                    value += layer
+                elif value <= -WIN_BOUND:
+                    value -= layer
+                return entry[1], value, entry[3], entry[4]
+        return None
+
+    def store(self, key, layer, value, bound, col):
+        """Record the result of searching a position to the given depth."""
+        if value >= WIN_BOUND:
+            value -= layer
+        elif value <= -WIN_BOUND:
+            value += layer
+        entry = (key, layer, value, bound, col)
+        i = 2 * (key % self.buckets)
+        kept = self.slots[i]
+        # Depth-preferred slot: take it when free, for the same position, or for an equal or deeper search
+        if kept is None or kept[0] == key or layer >= kept[1]:
+            self.slots[i] = entry
+        else:
+            self.slots[i + 1] = entry
+
+    def clear(self):
+        """Forget every stored position."""
+        self.slots = [None] * (2 * self.buckets)
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """A TranspositionTable in shared memory, which searches in any number of processes can use at once.
+
+    Entries are packed into two 64-bit words: the data (value, depth, bound and column) and the data xor the
+    key. Writers store both words without a lock; a reader only takes an entry whose words xor to the key it
+    looks for, so one torn by a concurrent write reads as a miss. Pickling a table, as handing it to a worker
+    process does, passes the name of its memory, which the worker attaches to once."""
+
+    HEADER = struct.Struct('<4sBQ')
+    MAGIC = b'C4TT'
+    # 2: Zobrist keys depend on the board size
+    VERSION = 2
+
+    def __init__(self, size=1 << 20, name=None):
+        """The table holds at most size entries. With a name, attach to an existing table's memory instead
+        of making new memory."""
+        self.buckets = max(1, size // 2)
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=32 * self.buckets)
+        self.slots = self.memory.buf.cast('Q')
+
+    def __reduce__(self):
+        return attach_table, (self.memory.name, 2 * self.buckets)
+
+    def __del__(self):
+        # The view has to go before the memory can close
+        slots = getattr(self, 'slots', None)
+        if slots is not None:
+            slots.release()
+
+    def lookup(self, key, layer):
+        """Return (depth, value, bound, col) stored for a key, or None. Win values are adjusted to layer."""
+        i = 4 * (key % self.buckets)
+        slots = self.slots
+        for j in (i, i + 2):
+            data = slots[j + 1]
+            if data and slots[j] ^ data == key:
+                value = (data & 0xffffffff) - (1 << 31)
+                if value >= WIN_BOUND:
+                    value += layer
+                elif value <= -WIN_BOUND:
+                    value -= layer
+                col = data >> 42 & 0xff
+                return data >> 32 & 0xff, value, data >> 40 & 3, col - 1 if col else None
+        return None
+
+    def store(self, key, layer, value, bound, col):
+        """Record the result of searching a position to the given depth."""
+        if value >= WIN_BOUND:
+            value -= layer
+        elif value <= -WIN_BOUND:
+            value += layer
+        data = value + (1 << 31) | layer << 32 | bound << 40 | (0 if col is None else col + 1) << 42
+        i = 4 * (key % self.buckets)
+        slots = self.slots
+        kept = slots[i + 1]
+        # Depth-preferred slot: take it when free, for the same position, or for an equal or deeper search
+        if not kept or slots[i] ^ kept == key or layer >= kept >> 32 & 0xff:
+            j = i
+        else:
+            j = i + 2
+        slots[j] = key ^ data
+        slots[j + 1] = data
+
+    def clear(self):
+        """Forget every stored position."""
+        self.memory.buf[:32 * self.buckets] = bytes(32 * self.buckets)
+
+    def save(self, path):
+        """Write the table to a file, for load to start a later run from."""
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.buckets))
+            f.write(self.memory.buf[:32 * self.buckets])
+
+    @classmethod
+    def load(cls, path):
+        """Return a new table holding what save wrote to a file."""
+        with open(path, 'rb') as f:
+            header = f.read(cls.HEADER.size)
+            if len(header) < cls.HEADER.size:
+                raise ValueError("%s is not a saved transposition table" % path)
+            magic, version, buckets = cls.HEADER.unpack(header)
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError("%s is not a saved transposition table" % path)
+            table = cls(2 * buckets)
+            if f.readinto(table.memory.buf[:32 * buckets]) != 32 * buckets:
+                table.close()
+                raise ValueError("%s is cut short" % path)
+        return table
+
+    def close(self):
+        """Let go of the shared memory; the process that made the table also frees it."""
+        self.slots.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# Shared tables this process has attached to, by name of their memory
+_shared_tables = {}
+
+
+def attach_table(name, size):
+    """Return the SharedTranspositionTable with the named memory, attaching to it the first time."""
+    if name not in _shared_tables:
+        _shared_tables[name] = SharedTranspositionTable(size, name)
+    return _shared_tables[name]
+
+
+class SolverTable(object):
+    """Fixed-size cache of endgame solver results: one 64-bit word per entry, holding a bound on the exact
+    value of a position.
+
+    Entries are replaced on every collision. The low bits of a key pick the slot, so only the rest of the key
+    is kept, and the freed bits hold the bound: whether it is a lower or an upper one, and its value."""
+
+    def __init__(self, size=1 << 18):
+        """The table holds size entries, rounded up to a power of two of at least 512."""
+        self.mask = (1 << max(9, (size - 1).bit_length())) - 1
+        self.slots = array.array('Q', [0]) * (self.mask + 1)
+
+    def lookup(self, key):
+        """Return (value, lower) stored for a key, or None. lower tells a lower bound from an upper one."""
+        word = self.slots[key & self.mask]
+        if word == 0 or (word ^ key) >> 9:
+            return None
+        return (word & 0xff) - 128, bool(word & 0x100)
+
+    def store(self, key, value, lower):
+        """Record a lower or upper bound on the value of a position; value must be within -128..127."""
+        self.slots[key & self.mask] = (key >> 9 << 9) | lower << 8 | (value + 128)
+
+    def clear(self):
+        """Forget every stored position."""
+        self.slots = array.array('Q', [0]) * len(self.slots)
+
+
+class OpeningBook(object):
+    """Best moves for early positions, read from a file written by OpeningBook.write (see book_connectfour.py).
+
+    The file is memory-mapped, not loaded: its records are sorted by position key, so a lookup is a binary
+    search over the mapped pages and opening even a large book costs nothing up front."""
+
+    # 2: Zobrist keys depend on the board size
+    VERSION = 2
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        valid = len(self.map) >= BOOK_HEADER.size
+        if valid:
+            magic, version, self.rows, self.cols, self.plies, self.size = BOOK_HEADER.unpack_from(self.map)
+            valid = (magic == BOOK_MAGIC and version == OpeningBook.VERSION
+                     and len(self.map) == BOOK_HEADER.size + self.size * BOOK_RECORD.size)
+        if not valid:
+            self.map.close()
+            raise ValueError("%s is not an opening book" % path)
+
+    def __len__(self):
+        return self.size
+
+    def lookup(self, key):
+        """Return the book move for the position with this canonical_key, or None if the book does not have it."""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found, col = BOOK_RECORD.unpack_from(self.map, BOOK_HEADER.size + mid * BOOK_RECORD.size)
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return col
+        return None
+
+    def close(self):
+        self.map.close()
+
+    @staticmethod
+    def write(path, moves, rows=ROWS, cols=COLS, plies=0):
+        """Write a book file from a dict of canonical_key to best column, for positions up to plies moves in."""
+        with open(path, 'wb') as f:
+            f.write(BOOK_HEADER.pack(BOOK_MAGIC, OpeningBook.VERSION, rows, cols, plies, len(moves)))
+            for key in sorted(moves):
+                f.write(BOOK_RECORD.pack(key, moves[key]))
+
+
+class SearchStats(object):
+    """What the searches of one or more MinimaxAgent moves did.
+
+    Leaf, cutoff and table counts cover the searching process only; nodes include the worker processes of a
+    parallel search."""
+
+    def __init__(self):
+        self.moves = 0
+        # Moves played straight from the opening book, without a search, moves solved to the end of the game and
+        # moves already searched while pondering
+        self.book_moves = 0
+        self.solved_moves = 0
+        self.ponder_hits = 0
+        self.nodes = 0
+        self.leaves = 0
+        self.table_probes = 0
+        self.table_hits = 0
+        self.seconds = 0.0
+        # Cutoffs made at each ply below the root
+        self.cutoffs = {}
+        # (depth, nodes, seconds) of every completed iteration
+        self.iterations = []
+        # Depth, value and principal variation of the last completed iteration of a single move
+        self.depth = 0
+        self.score = None
+        self.pv = []
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.seconds if self.seconds else 0.0
+
+    @property
+    def branching_factor(self):
+        """Effective branching factor: growth in nodes from one iteration to the next."""
+        ratios = [later[1] / earlier[1] for earlier, later in zip(self.iterations, self.iterations[1:])
+                  if earlier[0] + 1 == later[0] and earlier[1]]
+        return sum(ratios) / len(ratios) if ratios else 0.0
+
+    def add(self, other):
+        """Add the counts of another SearchStats into this one."""
+        self.moves += other.moves
+        self.book_moves += other.book_moves
+        self.solved_moves += other.solved_moves
+        self.ponder_hits += other.ponder_hits
+        self.nodes += other.nodes
+        self.leaves += other.leaves
+        self.table_probes += other.table_probes
+        self.table_hits += other.table_hits
+        self.seconds += other.seconds
+        for ply, count in other.cutoffs.items():
+            self.cutoffs[ply] = self.cutoffs.get(ply, 0) + count
+        self.iterations.extend(other.iterations)
+        return self
+
+    def summary(self):
+        """Return the statistics as a short printable report."""
+        lines = ["%d moves, %d nodes, %d leaves, %.2fs, %.0f nodes/s, branching factor %.2f" % (
+            self.moves, self.nodes, self.leaves, self.seconds, self.nodes_per_second, self.branching_factor)]
+        if self.book_moves or self.solved_moves or self.ponder_hits:
+            lines.append("%d book moves, %d solved moves, %d ponder hits" % (
+                self.book_moves, self.solved_moves, self.ponder_hits))
+        if self.table_probes:
+            lines.append("table hits %d of %d probes (%.0f%%)" % (
+                self.table_hits, self.table_probes, self.table_hits / self.table_probes * 100))
+        if self.cutoffs:
+            lines.append("cutoffs by ply: " + ' '.join("%d:%d" % item for item in sorted(self.cutoffs.items())))
+        depths = {}
+        for depth, nodes, seconds in self.iterations:
+            depths.setdefault(depth, []).append(seconds)
+        if depths:
+            lines.append("mean time per iteration: " + ' '.join(
+                "%d:%.4fs" % (depth, sum(times) / len(times)) for depth, times in sorted(depths.items())))
+        if self.moves == 1:
+            lines.append("depth %d, score %s, pv %s" % (self.depth, self.score, ' '.join(map(str, self.pv))))
+        return '\n'.join(lines)
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search when its time budget runs out."""
+
+
 class Agent(object):
-    """Abstract class, extended by classes RandomAgent, FirstMoveAgent, MinimaxAgent.
+    """Abstract class, extended by classes RandomAgent, FirstMoveAgent, MinimaxAgent, MCTSAgent.
     Do not make an instance of this class."""
 
     def __init__(self, color):
@@ -566,10 +831,15 @@ class Agent(object):
 class RandomAgent(Agent):
     """Naive agent -- always performs a random move"""
 
+    def __init__(self, color, rng=None):
+        """Moves are drawn from rng, a random.Random, or from the random module if none is given."""
+        super().__init__(color)
+        self.rng = rng if rng is not None else random
+
     def move(self, game):
         """Returns a random move"""
         # Selects a random move from the list of possible moves, i.e. open columns
-        col = random.choice(game.possible_moves())
+        col = self.rng.choice(game.possible_moves())
         return col
 
 
@@ -587,107 +857,1121 @@ class FirstMoveAgent(Agent):
 class MinimaxAgent(Agent):
     """Smart agent -- uses minimax to determine the best move"""
 
+    def __init__(self, color, depth=4, time_limit=None, table_size=1 << 16, ordering=ORDERINGS, workers=1,
+                 stats=False, batch=False, book=None, endgame=ENDGAME_CELLS, aspiration=ASPIRATION_WINDOW,
+                 ponder=False, table=None, threats=True):
+        """Searches up to depth plies (None for no limit) and, if time_limit is given, stops after that many
+        seconds per move. table_size caps the entries of the transposition table; 0 searches without one.
+        table is a transposition table to search with instead, such as a SharedTranspositionTable.
+        ordering names the move ordering heuristics to use, from ORDERINGS. workers > 1 splits the search of
+        each move over that many processes. With stats, every move leaves a SearchStats in last_stats.
+        batch scores the children of depth-1 nodes with one batch_evaluate call (needs numpy); with only up
+        to COLS boards per call this is slower than the incremental utility(), which stays the default.
+        book, an OpeningBook or the path of one, supplies moves for the positions it covers without a search.
+        Once no more than endgame cells are empty, moves are solved exactly instead; 0 turns the solver off.
+        Each iteration after the first searches a window of aspiration either side of the last score first;
+        0 searches full windows only. With ponder, the agent goes on searching in a background thread after
+        each move, for its answers to the opponent's replies. With threats, the search looks for immediate wins
+        and forced blocks at every node, leaves out moves that hand the opponent a win, and searches a lone
+        forced move a ply deeper."""
+        super().__init__(color)
+        self.depth = depth
+        self.time_limit = time_limit
+        self.table_size = table_size
+        if table is None and table_size:
+            table = TranspositionTable(table_size)
+        self.table = table
+        self.workers = workers
+        self.pool = None
+        # Counts the parallel root searches that have finished; a worker job stops early once the count moves
+        # past the one it was handed, as its result is no longer wanted
+        self.generation = None
+        if batch and np is None:
+            raise ImportError("batch evaluation needs numpy")
+        self.batch = batch
+        self.book = OpeningBook(book) if isinstance(book, str) else book
+        # Solver values count empty cells and must fit the solver table
+        if not 0 <= endgame <= 127:
+            raise ValueError("endgame must be between 0 and 127 empty cells")
+        self.endgame = endgame
+        self.aspiration = aspiration
+        self.threats = threats
+        self.ponder = ponder
+        self.ponder_thread = None
+        # Moves found while pondering, by the search_key of the position they answer, as (col, score, depth)
+        self.pondered = {}
+        # Made on the first solved move, then kept: a solved value holds whatever the game it turns up in
+        self.solver_table = None
+        self.ordering = frozenset(ordering)
+        unknown = self.ordering.difference(ORDERINGS)
+        if unknown:
+            raise ValueError("unknown move ordering %s" % ', '.join(sorted(unknown)))
+        self.deadline = None
+        # When set, a search stops as it would at the deadline once calling this returns true
+        self.abort = None
+        # Depth of the last completed iteration of the last move, and the nodes searched for it
+        self.depth_reached = 0
+        self.nodes = 0
+        self.collect_stats = stats
+        # SearchStats of the current or last move; only kept when collecting, so a plain search pays nothing
+        self.stats = None
+        self.last_stats = None
+        # Move count of the position at the root of the current search
+        self.root_ply = 0
+        self.clear_ordering()
+
+    def clear_ordering(self):
+        """Forget the killer moves and history scores learned so far."""
+        # Two killer columns for every ply of the game, counted from the empty board so that they line up
+        # between iterations
+        self.killers = {}
+        # How often dropping into each cell caused a cutoff, weighted by depth, for each side to move
+        self.history = {True: {}, False: {}}
+
     def move(self, game):
-        """Returns the best move using minimax"""
-        col, score = self.minimax(game, 4, True, -math.inf, math.inf)
+        """Returns the best move for the agent's colour using negamax"""
+        self.stop_pondering()
+        col = self.choose(game)
+        if self.ponder:
+            self.start_pondering(game, col)
         return col
 
-    # Apply Minimax algorithm (based on pseudocode from Wikipedia article on Minimax)
-    def minimax(self, game, layer, max_player, a, b):
-        # If depth is 0 or we reach the terminal node, return the heuristic value of the node
-        if layer == 0:
-            return None, game.utility()
-        if max_player:
-            # Maxvalue begins at -infinity
-            maxval = -math.inf
-            col = 0
-            for j in game.possible_moves():
-                # Iterate through possible moves and make recursive moves alternating between maxplayer and minplayer
-                val = MinimaxAgent.minimax(self, game.neighbor(j, 'R'), layer - 1, False, a, b, )[1]
-                # If returned value is greater than the max value, assign make the value the new max and compare it to
-                # alpha, taking the max of the value, alpha pair
-                if val > maxval:
-                    maxval = val
-                    col = j
-                a = max(a, maxval)
-                if a >= b:
-                    break
-            return col, maxval
+    def choose(self, game):
+        """Pick a move for the position in game: from the book, from what pondering found, by solving the
+        endgame, or by searching."""
+        start = time.perf_counter()
+        # Search on a private copy so the caller's game is never touched
+        board = game.copy()
+        red_to_move = self.color == 'R'
+        pondered = self.pondered.get(board.search_key(red_to_move))
+        self.pondered = {}
+        if pondered is not None:
+            col, score, self.depth_reached = pondered
+            self.nodes = 0
+            if self.collect_stats:
+                stats = self.last_stats = SearchStats()
+                stats.moves = stats.ponder_hits = 1
+                stats.seconds = time.perf_counter() - start
+                stats.depth, stats.score, stats.pv = self.depth_reached, score, [col]
+            return col
+        col = self.book_move(board)
+        if col is not None:
+            self.depth_reached = 0
+            self.nodes = 0
+            if self.collect_stats:
+                stats = self.last_stats = SearchStats()
+                stats.moves = stats.book_moves = 1
+                stats.seconds = time.perf_counter() - start
+                stats.pv = [col]
+            return col
+        if board.geometry.cells - board.move_count <= self.endgame:
+            if self.time_limit is not None:
+                self.deadline = start + self.time_limit
+            try:
+                col, score = self.solve_root(board, red_to_move)
+            except SearchTimeout:
+                # Too big to solve in time after all; fall back on the heuristic search
+                col = None
+            self.deadline = None
+            if col is not None:
+                if self.collect_stats:
+                    stats = self.last_stats = SearchStats()
+                    stats.moves = stats.solved_moves = 1
+                    stats.nodes = self.nodes
+                    stats.seconds = time.perf_counter() - start
+                    stats.depth, stats.score, stats.pv = self.depth_reached, score, [col]
+                return col
+        empty = board.geometry.cells - board.move_count
+        max_depth = empty if self.depth is None else min(self.depth, empty)
+        col = board.possible_moves()[0]
+        self.depth_reached = 0
+        self.nodes = 0
+        self.root_ply = board.move_count
+        self.clear_ordering()
+        stats = self.stats = SearchStats() if self.collect_stats else None
+        # The first iteration always finishes, so there is a searched move to fall back on
+        self.deadline = None
+        # Deepen one ply at a time. Each iteration leaves its best moves in the transposition table, where the
+        # next, deeper iteration picks them up to search first
+        score = None
+        for depth in range(1, max_depth + 1):
+            try:
+                if self.workers > 1 and depth > 1:
+                    col, score = self.parallel_root(board, depth, red_to_move)
+                else:
+                    col, score = self.aspiration_search(board, depth, red_to_move, score)
+            except SearchTimeout:
+                # Keep the move from the last completed iteration
+                break
+            self.depth_reached = depth
+            if stats is not None:
+                stats.iterations.append((depth, self.nodes - sum(it[1] for it in stats.iterations),
+                                         time.perf_counter() - start - sum(it[2] for it in stats.iterations)))
+                stats.depth, stats.score = depth, score
+            # Once a forced win or loss is found, searching deeper cannot change it
+            if abs(score) >= WIN_BOUND:
+                break
+            if self.time_limit is not None:
+                self.deadline = start + self.time_limit
+        self.deadline = None
+        if stats is not None:
+            stats.moves = 1
+            stats.nodes = self.nodes
+            stats.seconds = time.perf_counter() - start
+            stats.pv = self.principal_variation(board, col, red_to_move)
+            self.last_stats = stats
+            self.stats = None
+        return col
+
+    def start_pondering(self, game, col):
+        """Start searching, in a background thread, the position after our move into col."""
+        board = game.copy()
+        board.make_move(col, self.color)
+        if board.last_move_state() is not None:
+            return
+        # The searches check the deadline at every node; one that never passes keeps them checking, and
+        # stop_pondering moves it into the past
+        self.deadline = math.inf
+        self.ponder_thread = threading.Thread(target=self.ponder_replies, args=(board,), daemon=True)
+        self.ponder_thread.start()
+
+    def stop_pondering(self):
+        """Stop the pondering thread, keeping whatever it finished."""
+        if self.ponder_thread is None:
+            return
+        self.deadline = -math.inf
+        self.ponder_thread.join()
+        self.ponder_thread = None
+        self.deadline = None
+
+    def ponder_replies(self, game):
+        """Search our answer to each reply the opponent can make, likeliest first, until stopped. Answers
+        searched as deep as a move would search them go into pondered; the rest leave their work in the table."""
+        red_to_move = self.color == 'R'
+        replies = game.possible_moves()
+        self.order_moves(game, replies, not red_to_move, self.table_move(game, not red_to_move))
+        try:
+            for reply in replies:
+                game.make_move(reply, 'B' if red_to_move else 'R')
+                if game.last_move_state() is None and self.book_move(game) is None:
+                    self.pondered[game.search_key(red_to_move)] = self.ponder_search(game, red_to_move)
+                game.unmake_move(reply)
+        except SearchTimeout:
+            pass
+
+    def ponder_search(self, game, red_to_move):
+        """Search a position while pondering the way choose would, and return (col, score, depth)."""
+        empty = game.geometry.cells - game.move_count
+        if empty <= self.endgame:
+            col, score = self.solve_root(game, red_to_move)
+            return col, score, self.depth_reached
+        max_depth = empty if self.depth is None else min(self.depth, empty)
+        self.root_ply = game.move_count
+        self.clear_ordering()
+        score = None
+        for depth in range(1, max_depth + 1):
+            col, score = self.aspiration_search(game, depth, red_to_move, score)
+            if abs(score) >= WIN_BOUND:
+                break
+        return col, score, depth
+
+    def book_move(self, game):
+        """Return the opening book's move for this position, or None if there is no book or it has none."""
+        book = self.book
+        if (book is None or game.move_count > book.plies
+                or (book.rows, book.cols) != (game.geometry.rows, game.geometry.cols)):
+            return None
+        # The book holds the best move for the side to move, so a position only turns up with the right side on
+        # move. Mirror images share a record, with the move for the canonical one
+        key, mirrored = game.canonical_key(self.color == 'R')
+        col = book.lookup(key)
+        if col is not None and mirrored:
+            col = game.mirror_col(col)
+        # A hash collision could name a full column; search instead
+        if col is not None and col not in game.possible_moves():
+            return None
+        return col
+
+    def solve_root(self, game, red_to_move):
+        """Solve the position for the side to move. Returns the best move and its exact value to that side:
+        0 for a draw, otherwise WIN_SCORE plus the empty cells left after the winning move, negated for a loss."""
+        if self.solver_table is None:
+            self.solver_table = SolverTable()
+        self.depth_reached = 0
+        self.nodes = 0
+        # Narrow the value down with null-window searches, each a yes or no on whether it beats a guess
+        lo, hi = -game.geometry.cells, game.geometry.cells
+        while lo < hi:
+            guess = lo + (hi - lo) // 2
+            value = self.solve(game, red_to_move, guess, guess + 1)
+            if value <= guess:
+                hi = value
+            else:
+                lo = value
+        # Then find a move that reaches it; the table has most of the answers already
+        moves = game.possible_moves()
+        moves.sort(key=game.geometry.center_rank.__getitem__)
+        for col in moves:
+            game.make_move(col, 'R' if red_to_move else 'B')
+            if game.is_win_at(col):
+                value = game.geometry.cells - game.move_count + 1
+            elif game.is_full():
+                value = 0
+            else:
+                value = -self.solve(game, not red_to_move, -lo, -lo + 1)
+            game.unmake_move(col)
+            if value >= lo:
+                break
+        self.depth_reached = game.geometry.cells - game.move_count
+        if lo == 0:
+            return col, 0
+        return col, WIN_SCORE + lo - 1 if lo > 0 else -WIN_SCORE + lo + 1
+
+    def solve(self, game, red_to_move, a, b):
+        """Search to the end of the game for the value of the side to move, within the (a, b) window: the
+        empty cells left after a winning move plus one, the negation of that for a loss, or 0 for a draw."""
+        self.nodes += 1
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        if self.abort is not None and not self.nodes & 255 and self.abort():
+            raise SearchTimeout()
+        empty = game.geometry.cells - game.move_count
+        color = 'R' if red_to_move else 'B'
+        if self.threats:
+            win, moves = self.forced_moves(game, red_to_move)
+            if win is not None:
+                return empty
         else:
-            # Min_player so to speak
-            # Minvalue begins at infinity
-            minval = math.inf
-            col = 0
-            for j in game.possible_moves():
-                val = MinimaxAgent.minimax(self, game.neighbor(j, 'B'), layer - 1, True, a, b)[1]
-                # If returned value is less than the min value, assign the value with the new min and compare it to
-                # beta, taking the min of the value, beta pair
-                if val < minval:
-                    minval = val
-                    col = j
-                b = min(b, minval)
-                if a >= b:
+            moves = game.possible_moves()
+            for col in moves:
+                game.make_move(col, color)
+                won = game.is_win_at(col)
+                game.unmake_move(col)
+                if won:
+                    return empty
+        # Filling the last cell without a win draws
+        if empty <= 1:
+            return 0
+        # Without a win now, the best left is a win with our next move and the worst a loss to the reply
+        hi = empty - 2
+        lo = 1 - empty
+        if self.threats:
+            if not moves:
+                return lo
+            # Moves that lose to the reply are gone, so the worst left is a loss a move later, if there is
+            # room for one
+            lo = min(0, 3 - empty)
+        key = game.canonical_key(red_to_move)[0]
+        entry = self.solver_table.lookup(key)
+        if entry is not None:
+            if entry[1]:
+                lo = max(lo, entry[0])
+            else:
+                hi = min(hi, entry[0])
+        a = max(a, lo)
+        b = min(b, hi)
+        if a >= b:
+            return a
+        moves.sort(key=game.geometry.center_rank.__getitem__)
+        for col in moves:
+            game.make_move(col, color)
+            value = -self.solve(game, not red_to_move, -b, -a)
+            game.unmake_move(col)
+            if value >= b:
+                self.solver_table.store(key, value, True)
+                return value
+            if value > a:
+                a = value
+        self.solver_table.store(key, a, False)
+        return a
+
+    def aspiration_search(self, game, depth, red_to_move, score):
+        """Search the root to depth, first within a window around score, the value of the iteration before."""
+        if score is not None and self.aspiration and abs(score) < WIN_BOUND:
+            a, b = score - self.aspiration, score + self.aspiration
+            col, value = self.negamax(game, depth, red_to_move, a, b)
+            if a < value < b:
+                return col, value
+            # The value fell outside the window: all that is known is a bound, so search again with that side open
+            if value <= a:
+                return self.negamax(game, depth, red_to_move, -math.inf, b)
+            return self.negamax(game, depth, red_to_move, a, math.inf)
+        return self.negamax(game, depth, red_to_move, -math.inf, math.inf)
+
+    def principal_variation(self, game, col, red_to_move):
+        """Return the line of best play from a position, starting with col, read out of the table."""
+        pv = [col]
+        board = game.copy()
+        while self.table is not None and len(pv) <= self.depth_reached:
+            board.make_move(pv[-1], 'R' if red_to_move else 'B')
+            if board.last_move_state() is not None:
+                break
+            red_to_move = not red_to_move
+            col = self.table_move(board, red_to_move)
+            if col is None or col not in board.possible_moves():
+                break
+            pv.append(col)
+        return pv
+
+    def parallel_root(self, game, depth, red_to_move):
+        """Search the root by searching the first move alone for a bound, then the other moves in parallel."""
+        # Young Brothers Wait: the first move, the likeliest best after ordering, is searched here with a full
+        # window. Its value is the alpha the remaining moves have to beat, so they search much smaller trees
+        moves = game.possible_moves()
+        self.order_moves(game, moves, red_to_move, self.table_move(game, red_to_move))
+        color = 'R' if red_to_move else 'B'
+        # An immediate win needs no search, and ruling one out lets a win two plies down end the search below
+        for col in moves:
+            game.make_move(col, color)
+            won = game.is_win_at(col)
+            game.unmake_move(col)
+            if won:
+                self.remember(game, depth, red_to_move, -math.inf, math.inf, col, WIN_SCORE + depth)
+                return col, WIN_SCORE + depth
+        col = moves[0]
+        game.make_move(col, color)
+        a = MinimaxAgent.terminal_value(game, col, depth)
+        if a is None:
+            a = -self.negamax(game, depth - 1, not red_to_move, -math.inf, math.inf)[1]
+        game.unmake_move(col)
+        # No move but an immediate win, ruled out above, scores more than a win two plies down
+        ceiling = WIN_SCORE + depth - 2
+        if self.pool is None:
+            self.generation = RawValue('Q', 0)
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_search_worker,
+                                            initargs=(self.generation,))
+        pending = moves[1:]
+        running = {}
+        try:
+            while pending or running:
+                if a >= ceiling:
+                    # Nothing left can beat what we have; drop the rest
                     break
-            return col, minval
+                # Keep every worker busy, handing each new move the best alpha so far
+                while pending and len(running) < self.workers:
+                    j = pending.pop(0)
+                    time_left = None if self.deadline is None else self.deadline - time.perf_counter()
+                    running[self.pool.submit(search_child, game.red, game.black, game.geometry.rows,
+                                             game.geometry.cols, j, red_to_move, depth, a, time_left,
+                                             tuple(self.ordering), self.table_size, self.shared_table(),
+                                             self.threats, self.generation.value)] = j
+                time_left = None if self.deadline is None else max(0, self.deadline - time.perf_counter())
+                done, not_done = wait(running, timeout=time_left, return_when=FIRST_COMPLETED)
+                if not done:
+                    raise SearchTimeout()
+                for future in done:
+                    j = running.pop(future)
+                    val, nodes = future.result()
+                    self.nodes += nodes
+                    if val is None:
+                        raise SearchTimeout()
+                    # A value above alpha is exact; anything else failed low and cannot be the best move
+                    if val > a:
+                        col, a = j, val
+        finally:
+            # Every job handed out is already running, so cancelling would do nothing; moving the generation on
+            # tells them to stop instead, which frees the workers for the next search
+            if running:
+                self.generation.value += 1
+        self.remember(game, depth, red_to_move, -math.inf, math.inf, col, a)
+        return col, a
+
+    def shared_table(self):
+        """Return the agent's table if worker processes can search with it too, otherwise None."""
+        return self.table if isinstance(self.table, SharedTranspositionTable) else None
+
+    def close(self):
+        """Stop pondering and shut down the worker processes of a parallel search."""
+        self.stop_pondering()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    # Negamax form of minimax with alpha-beta pruning (based on pseudocode from the Wikipedia articles on
+    # Negamax and Principal variation search): values are always for the side to move, so one branch serves both
+    def negamax(self, game, layer, red_to_move, a, b):
+        """Search layer plies below a position, within the (a, b) window. Returns the best move for the side
+        to move, red if red_to_move and black otherwise, and its value to that side."""
+        # The whole tree is walked on one board: each child is made in place and unmade after its search, so
+        # the board is back as it was when this returns
+        self.nodes += 1
+        # If depth is 0, return the heuristic value of the node
+        if layer == 0:
+            if self.stats is not None:
+                self.stats.leaves += 1
+            return None, game.utility() if red_to_move else -game.utility()
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        # Asking is a read of shared memory, so only every 256 nodes
+        if self.abort is not None and not self.nodes & 255 and self.abort():
+            raise SearchTimeout()
+        if self.threats:
+            win, moves = self.forced_moves(game, red_to_move)
+            if win is not None:
+                return win, WIN_SCORE + layer
+            if not moves:
+                # Every move loses to the reply
+                return game.possible_moves()[0], -WIN_SCORE - layer + 1
+        else:
+            moves = game.possible_moves()
+        # A forced move costs no branching, so it is searched without using up a ply
+        child_layer = layer if self.threats and len(moves) == 1 else layer - 1
+        if child_layer == 0 and self.batch:
+            return self.evaluate_frontier(game, red_to_move, moves)
+        a0, b0 = a, b
+        best = None
+        canonical = None
+        if self.table is not None:
+            # A position and its mirror image share an entry, with the move stored for the canonical one
+            canonical = key, mirrored = game.canonical_key(red_to_move)
+            entry = self.table.lookup(key, layer)
+            if self.stats is not None:
+                self.stats.table_probes += 1
+                self.stats.table_hits += entry is not None
+            if entry is not None:
+                depth, value, bound, best = entry
+                if mirrored:
+                    best = game.mirror_col(best)
+                # A search at least as deep can settle this node, or narrow its window
+                if depth >= layer:
+                    if bound == TranspositionTable.EXACT:
+                        return best, value
+                    elif bound == TranspositionTable.LOWER:
+                        a = max(a, value)
+                    else:
+                        b = min(b, value)
+                    if a >= b:
+                        return best, value
+        self.order_moves(game, moves, red_to_move, best)
+        color = 'R' if red_to_move else 'B'
+        # Value begins at -infinity
+        maxval = -math.inf
+        col = moves[0]
+        for j in moves:
+            game.make_move(j, color)
+            val = MinimaxAgent.terminal_value(game, j, layer)
+            if val is None:
+                if maxval == -math.inf:
+                    # The first move, the likeliest best after ordering, gets the full window
+                    val = -self.negamax(game, child_layer, not red_to_move, -b, -a)[1]
+                else:
+                    # The rest only have to be shown no better than alpha, which a null window does cheaply;
+                    # one that turns out better is searched again for its value
+                    val = -self.negamax(game, child_layer, not red_to_move, -a - 1, -a)[1]
+                    if a < val < b:
+                        val = -self.negamax(game, child_layer, not red_to_move, -b, -a)[1]
+            game.unmake_move(j)
+            if val > maxval:
+                maxval = val
+                col = j
+            a = max(a, maxval)
+            if a >= b:
+                self.note_cutoff(game, j, red_to_move, layer)
+                break
+        self.remember(game, layer, red_to_move, a0, b0, col, maxval, canonical)
+        return col, maxval
+
+    @staticmethod
+    def forced_moves(game, red_to_move):
+        """Narrow the moves of the side to move down by the threats on the board. Returns (win, moves): a
+        column that wins at once, or None and the moves worth searching. Those are the block if the opponent
+        has one cell to win with, otherwise every move that does not give the opponent a win right above it;
+        none if every move loses to the reply."""
+        # Without three pieces of one colour in some window there is nothing to find
+        if 3 not in game.red_counts and 3 not in game.black_counts:
+            return None, game.possible_moves()
+        wins, blocks, unplayable = game.threats(red_to_move)
+        rows = game.geometry.rows
+        if wins:
+            return ((wins & -wins).bit_length() - 1) // rows, []
+        if blocks:
+            if blocks & (blocks - 1):
+                # Two cells to block: the opponent wins with the other one
+                return None, []
+            col = (blocks.bit_length() - 1) // rows
+            return None, [] if blocks & unplayable else [col]
+        column = game.geometry.column
+        return None, [col for col in game.possible_moves() if not unplayable >> (col * rows) & column]
+
+    def evaluate_frontier(self, game, red_to_move, moves):
+        """Search a depth-1 node by scoring the children moves lead to in one batch_evaluate call."""
+        boards = []
+        for j in moves:
+            bit = 1 << (j * game.geometry.rows + game.heights[j])
+            boards.append((game.red | bit, game.black) if red_to_move else (game.red, game.black | bit))
+        scores, winners = batch_evaluate(np.array(boards, dtype=np.uint64), game.geometry.rows, game.geometry.cols)
+        self.nodes += len(moves)
+        if self.stats is not None:
+            self.stats.leaves += len(moves)
+        values = []
+        sign = 1 if red_to_move else -1
+        for score, winner in zip(scores.tolist(), winners.tolist()):
+            # The node itself is not won, so a four on a child board is the piece just dropped; same values
+            # as terminal_value gives at layer 1
+            if winner:
+                values.append(WIN_SCORE + 1)
+            elif game.move_count + 1 == game.geometry.cells:
+                values.append(0)
+            else:
+                values.append(sign * score)
+        best = max(values)
+        return moves[values.index(best)], best
+
+    def order_moves(self, game, moves, red_to_move, best):
+        """Sort moves in place so the likeliest cutoffs come first."""
+        # Each heuristic moves its picks ahead of the earlier ones, so the last applied has the most say
+        if 'center' in self.ordering:
+            moves.sort(key=game.geometry.center_rank.__getitem__)
+        if 'history' in self.ordering:
+            history = self.history[red_to_move]
+            rows = game.geometry.rows
+            moves.sort(key=lambda col: -history.get(col * rows + game.heights[col], 0))
+        if 'killers' in self.ordering:
+            for killer in reversed(self.killers.get(game.move_count, ())):
+                if killer in moves:
+                    moves.remove(killer)
+                    moves.insert(0, killer)
+        # Threats can rule out the stored move, so it may not be among the moves
+        if 'table' in self.ordering and best in moves:
+            moves.remove(best)
+            moves.insert(0, best)
 
+    def note_cutoff(self, game, col, red_to_move, layer):
+        """Record a move that caused a cutoff as a killer for this ply and in the history table."""
+        killers = self.killers.setdefault(game.move_count, [None, None])
+        if killers[0] != col:
+            killers[1] = killers[0]
+            killers[0] = col
+        cell = col * game.geometry.rows + game.heights[col]
+        history = self.history[red_to_move]
+        history[cell] = history.get(cell, 0) + layer * layer
+        if self.stats is not None:
+            ply = game.move_count - self.root_ply
+            self.stats.cutoffs[ply] = self.stats.cutoffs.get(ply, 0) + 1
 
-def tournament(simulations=50):
-    """Simulate connect four games, of a minimax agent playing
-    against a random agent"""
+    def table_move(self, game, red_to_move):
+        """Return the best move the transposition table holds for a position, or None."""
+        if self.table is None:
+            return None
+        key, mirrored = game.canonical_key(red_to_move)
+        entry = self.table.lookup(key, 0)
+        if entry is None:
+            return None
+        return game.mirror_col(entry[3]) if mirrored else entry[3]
+
+    def remember(self, game, layer, red_to_move, a, b, col, val, canonical=None):
+        """Store a search result in the transposition table, with the bound the (a, b) window gives it.
+        canonical is the position's canonical_key, if the caller has it already."""
+        if self.table is None:
+            return
+        if val <= a:
+            bound = TranspositionTable.UPPER
+        elif val >= b:
+            bound = TranspositionTable.LOWER
+        else:
+            bound = TranspositionTable.EXACT
+        key, mirrored = canonical or game.canonical_key(red_to_move)
+        self.table.store(key, layer, val, bound, game.mirror_col(col) if mirrored else col)
+
+    @staticmethod
+    def terminal_value(game, col, layer):
+        """Return the value of the game to the player who dropped the last piece, into col, if that ended it,
+        otherwise None."""
+        # Only the last piece can have completed a four; wins found higher in the tree (more layers left) score more
+        if game.is_win_at(col):
+            return WIN_SCORE + layer
+        if game.is_full():
+            return 0
+        return None
+
+
+# Search agents of a worker process, one per configuration, so their tables outlive single jobs
+_worker_agents = {}
+# The generation counter of the MinimaxAgent whose pool started this worker process
+_search_generation = None
+
+
+def init_search_worker(generation):
+    """Start a worker process of a parallel root search, with the agent's shared generation counter."""
+    global _search_generation
+    _search_generation = generation
+
+
+def search_child(red, black, rows, cols, col, red_to_move, depth, a, time_left, ordering, table_size, table=None,
+                 threats=True, generation=None):
+    """Worker job of a parallel root search: search the move into col on a rows x cols board, by red if
+    red_to_move and black otherwise, at the root of a depth-ply search, for a value to the mover above a.
+    Searches with a shared table if one is given, and with threats as MinimaxAgent does. Returns (value,
+    nodes), with value None if time_left seconds ran out, or if the search that handed out the job, of the given
+    generation, finished first."""
+    key = (ordering, table_size, id(table), threats)
+    if key not in _worker_agents:
+        _worker_agents[key] = MinimaxAgent('R', table_size=table_size, ordering=ordering, table=table,
+                                           threats=threats)
+    agent = _worker_agents[key]
+    game = Game.from_bitboards(red, black, rows, cols)
+    game.make_move(col, 'R' if red_to_move else 'B')
+    value = MinimaxAgent.terminal_value(game, col, depth)
+    if value is not None:
+        return value, 1
+    agent.nodes = 0
+    agent.deadline = None if time_left is None else time.perf_counter() + time_left
+    if generation is not None and _search_generation is not None:
+        agent.abort = lambda: _search_generation.value != generation
+    try:
+        # A null window shows most moves no better than a; only one that beats it needs its exact value
+        value = -agent.negamax(game, depth - 1, not red_to_move, -a - 1, -a)[1]
+        if value > a:
+            value = -agent.negamax(game, depth - 1, not red_to_move, -math.inf, -a)[1]
+    except SearchTimeout:
+        value = None
+    agent.deadline = None
+    agent.abort = None
+    return value, agent.nodes
+
+
+class MCTSNode(object):
+    """A position in an MCTSAgent's search tree, reached by dropping a piece into column move."""
+
+    def __init__(self, parent, move, moves):
+        self.parent = parent
+        self.move = move
+        # Expanded children by column, and the legal moves not expanded yet
+        self.children = {}
+        self.untried = moves
+        self.visits = 0
+        # Rollout results summed for the player who made move: 1 for a win, 0.5 for a draw
+        self.wins = 0.0
+        # Result for that player if move ended the game, otherwise None
+        self.result = None
+
+
+class MCTSAgent(Agent):
+    """Monte Carlo tree search agent -- plays the move whose random playouts do best, growing its tree by UCT"""
+
+    def __init__(self, color, iterations=1000, time_limit=None, rollouts=1, workers=1, exploration=math.sqrt(2),
+                 rng=None):
+        """Runs up to iterations tree iterations per move (None for no limit), stopping early after time_limit
+        seconds if one is given. Each iteration plays rollouts random games from the leaf it adds, which spreads
+        the cost of walking the tree over the batch; workers > 1 plays them in that many processes, which only
+        pays off for large batches. exploration is the UCT constant. Rollout moves are drawn from rng, a
+        random.Random, or from the random module if none is given."""
+        super().__init__(color)
+        if iterations is None and time_limit is None:
+            raise ValueError("MCTSAgent needs an iteration or a time budget")
+        # Without a single iteration there is no tree to pick a move from, and without rollouts no scores
+        if iterations is not None and iterations < 1:
+            raise ValueError("MCTSAgent needs at least one iteration")
+        if rollouts < 1:
+            raise ValueError("MCTSAgent needs at least one rollout per iteration")
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.rollouts = rollouts
+        self.workers = workers
+        self.pool = None
+        self.exploration = exploration
+        self.rng = rng if rng is not None else random
+        # The tree of the last move and the position at its root, kept to carry on from on the next move
+        self.root = None
+        self.root_game = None
+        # Iterations run for the last move
+        self.nodes = 0
+
+    def move(self, game):
+        """Returns the most visited move after growing the tree"""
+        start = time.perf_counter()
+        root = self.reuse(game)
+        if root is None:
+            root = MCTSNode(None, None, game.possible_moves())
+        # The tree walks are made and taken back on a private copy
+        board = game.copy()
+        red_to_move = self.color == 'R'
+        self.nodes = 0
+        while self.iterations is None or self.nodes < self.iterations:
+            self.iterate(board, root, red_to_move)
+            self.nodes += 1
+            if self.time_limit is not None and time.perf_counter() - start > self.time_limit:
+                break
+        col = max(root.children.values(), key=lambda child: child.visits).move
+        self.root, self.root_game = root, game.copy()
+        return col
+
+    def reuse(self, game):
+        """Return the node of the kept tree for the position in game, or None if the tree does not reach it."""
+        if self.root is None:
+            return None
+        # Replay the moves made since the kept position, ours first, and make sure they lead to this one
+        board = self.root_game.copy()
+        played = game.history[board.move_count:]
+        colors = (self.color, 'B' if self.color == 'R' else 'R')
+        try:
+            for i, col in enumerate(played):
+                board.make_move(col, colors[i % 2])
+        except ValueError:
+            return None
+        if (board.red, board.black) != (game.red, game.black):
+            return None
+        node = self.root
+        for col in played:
+            node = node.children.get(col)
+            if node is None:
+                return None
+        # Let go of the rest of the old tree
+        node.parent = None
+        return node
+
+    def iterate(self, game, root, red_to_move):
+        """Run one iteration: select a leaf by UCT, expand it, play rollouts from it and back up the results."""
+        node = root
+        played = []
+        # Selection: walk down while every move of the node has been tried
+        while not node.untried and node.children:
+            node = self.select(node)
+            game.make_move(node.move, 'R' if red_to_move else 'B')
+            played.append(node.move)
+            red_to_move = not red_to_move
+        # Expansion: add one untried move as a new leaf
+        if node.untried:
+            col = node.untried.pop(self.rng.randrange(len(node.untried)))
+            game.make_move(col, 'R' if red_to_move else 'B')
+            played.append(col)
+            red_to_move = not red_to_move
+            child = MCTSNode(node, col, game.possible_moves())
+            if game.is_win_at(col):
+                child.result = 1.0
+                child.untried = []
+            elif game.is_full():
+                child.result = 0.5
+            node.children[col] = child
+            node = child
+        # Simulation: a finished game needs no rollouts
+        if node.result is not None:
+            score = node.result * self.rollouts
+        elif self.workers > 1:
+            score = self.parallel_rollouts(game, red_to_move)
+        else:
+            score = play_rollouts(game, red_to_move, self.rollouts, self.rng)
+        # Backpropagation: each level up scores the results for the other player
+        visits = self.rollouts
+        while node is not None:
+            node.visits += visits
+            node.wins += score
+            score = visits - score
+            node = node.parent
+        for col in reversed(played):
+            game.unmake_move(col)
+
+    def select(self, node):
+        """Return the child of a node with the highest upper confidence bound."""
+        log_visits = math.log(node.visits)
+        exploration = self.exploration
+        return max(node.children.values(), key=lambda child: (
+            child.wins / child.visits + exploration * math.sqrt(log_visits / child.visits)))
+
+    def parallel_rollouts(self, game, red_to_move):
+        """Split the rollouts from a leaf over the worker processes and return their summed results."""
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        share, extra = divmod(self.rollouts, self.workers)
+        futures = [self.pool.submit(rollout_batch, game.red, game.black, game.geometry.rows, game.geometry.cols,
+                                    red_to_move, share + (i < extra), self.rng.getrandbits(32))
+                   for i in range(self.workers) if share + (i < extra)]
+        return sum(future.result() for future in futures)
+
+    def close(self):
+        """Shut down the worker processes of parallel rollouts."""
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+
+def play_rollouts(game, red_to_move, count, rng):
+    """Play count games of random moves from a position and return their summed results for the player not
+    to move: 1 for a win, 0.5 for a draw. The game is back as it was when this returns."""
+    score = 0.0
+    for i in range(count):
+        # Moves are made in place, the same way the search makes them, and taken back at the end
+        played = []
+        result = 0.5
+        turn = red_to_move
+        moves = game.possible_moves()
+        while moves:
+            col = rng.choice(moves)
+            game.make_move(col, 'R' if turn else 'B')
+            played.append(col)
+            if game.is_win_at(col):
+                result = 0.0 if turn == red_to_move else 1.0
+                break
+            turn = not turn
+            if game.heights[col] == game.geometry.rows:
+                moves = game.possible_moves()
+        for col in reversed(played):
+            game.unmake_move(col)
+        score += result
+    return score
+
+
+def rollout_batch(red, black, rows, cols, red_to_move, count, seed):
+    """Worker job of leaf-parallel rollouts: play_rollouts from a position given as bitboards."""
+    return play_rollouts(Game.from_bitboards(red, black, rows, cols), red_to_move, count, random.Random(seed))
+
+
+def ordering_report(depth=6, positions=12, seed=0):
+    """Search a fixed set of positions with each move ordering heuristic on its own, then all together,
+    and print the nodes each needed"""
+    # Positions from random play, stopped short of any win
+    rng = random.Random(seed)
+    games = []
+    while len(games) < positions:
+        game = Game([['-' for i in range(COLS)] for j in range(ROWS)])
+        for ply in range(rng.randrange(0, 2 * COLS, 2)):
+            game.make_move(rng.choice(game.possible_moves()), 'RB'[ply % 2])
+            if game.last_move_state() is not None:
+                break
+        else:
+            games.append(game)
+    configs = [()] + [(name,) for name in ORDERINGS] + [ORDERINGS]
+    baseline = None
+    for config in configs:
+        nodes = 0
+        for game in games:
+            agent = MinimaxAgent('R', depth=depth, ordering=config)
+            agent.move(game)
+            nodes += agent.nodes
+        if baseline is None:
+            baseline = nodes
+        print("%-30s %10d nodes (%.0f%% of unordered)" % (
+            ', '.join(config) or 'none', nodes, nodes / baseline * 100))
+
+
+class Profiler(object):
+    """Context manager that runs a block under cProfile and tracemalloc, then prints a short report on the
+    engine's hot functions and memory, and writes the profile to a file for pstats, snakeviz and the like.
+    Tracing every allocation slows the run several times over, so the times are only good for comparing."""
+
+    # The Game and MinimaxAgent functions the report always lists, hit or not
+    HOT_FUNCTIONS = ('Game.neighbor', 'Game.copy', 'Game.make_move', 'Game.unmake_move', 'Game.possible_moves',
+                     'Game.winning_state', 'Game.last_move_state', 'Game.threats', 'Game.utility', 'Game.redscore',
+                     'Game.blackscore', 'MinimaxAgent.choose', 'MinimaxAgent.negamax', 'MinimaxAgent.solve')
+
+    def __init__(self, path, top=10):
+        """path is the file to write the profile to; the report adds the top functions by own time."""
+        self.path = path
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.seconds = 0.0
+
+    def __enter__(self):
+        # Keep enough frames to tell what called each allocation
+        tracemalloc.start(4)
+        self.start = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        self.seconds = time.perf_counter() - self.start
+        self.snapshot = tracemalloc.take_snapshot()
+        self.current, self.peak = tracemalloc.get_traced_memory()
+        # What one copy of a game allocates, measured while still tracing
+        game = Game([['-' for i in range(COLS)] for j in range(ROWS)])
+        before = tracemalloc.get_traced_memory()[0]
+        copy = game.copy()
+        self.copy_bytes = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        self.profile.dump_stats(self.path)
+        print(self.report())
+        return False
+
+    def report(self):
+        """Return the report as printable lines."""
+        stats = pstats.Stats(self.profile).stats
+        # pstats keys functions by (file, first line, name); the classes' own code objects give the keys
+        hot = {}
+        for name in Profiler.HOT_FUNCTIONS:
+            code = getattr(globals()[name.split('.')[0]], name.split('.')[1]).__code__
+            hot[name] = stats.get((code.co_filename, code.co_firstlineno, code.co_name), (0, 0, 0.0, 0.0, {}))
+        lines = ["profile: %.2fs, written to %s" % (self.seconds, self.path),
+                 "%-28s %10s %10s %10s %10s" % ('function', 'calls', 'own s', 'total s', 'us/call')]
+        for name, (primitive, calls, own, total, callers) in hot.items():
+            lines.append("%-28s %10d %10.3f %10.3f %10.2f" % (name, calls, own, total,
+                                                              own / calls * 1e6 if calls else 0.0))
+        lines.append("top %d by own time:" % self.top)
+        ranked = sorted(stats.items(), key=lambda item: -item[1][2])[:self.top]
+        for (filename, lineno, function), (primitive, calls, own, total, callers) in ranked:
+            lines.append("%-28s %10d %10.3f %10.3f  %s:%d" % (
+                function[:28], calls, own, total, os.path.basename(filename), lineno))
+        copies = hot['Game.copy'][1]
+        lines.append("memory: peak %.1f KiB, %.1f KiB still held; %d game copies of %d bytes, %.1f KiB in all" % (
+            self.peak / 1024, self.current / 1024, copies, self.copy_bytes, copies * self.copy_bytes / 1024))
+        # Memory still held at the end, by where in the engine it was allocated
+        held = self.snapshot.filter_traces([tracemalloc.Filter(True, __file__)]).statistics('lineno')
+        for stat in held[:5]:
+            frame = stat.traceback[0]
+            lines.append("  %8.1f KiB in %6d blocks at %s:%d" % (
+                stat.size / 1024, stat.count, os.path.basename(frame.filename), frame.lineno))
+        return '\n'.join(lines)
+
+
+def tournament(simulations=50, workers=1, seed=None, stats=False, book=None, red=None, black=None,
+               shared_table=None, table_file=None, profile=None):
+    """Simulate connect four games, by default of a minimax agent playing
+    against a random agent. With seed, game i is played with seed + i, so runs can be repeated;
+    workers > 1 plays the games in that many processes. stats prints a summary of the minimax searches.
+    book is the path of an opening book for the minimax agent. red and black pick other agents, as for
+    single_game; with workers > 1 they have to be picklable, as classes and functools.partial objects are.
+    With shared_table, a number of entries, the minimax agents of every game and process search with one
+    SharedTranspositionTable that lasts the whole run. table_file keeps that table between runs: it is
+    loaded from the file if there is one, and saved to it at the end. profile, a file path, runs the tournament
+    under a Profiler writing to it; the games are then played in this process, where the profiler sees them"""
+    if profile is not None:
+        with Profiler(profile):
+            return tournament(simulations, 1, seed, stats, book, red, black, shared_table, table_file)
     redwin, blackwin, tie = 0, 0, 0
-    for i in range(simulations):
-        game = single_game(io=False)
-        print(i, end=" ")
-        if game.winning_state() == float("inf"):
-            redwin += 1
-        elif game.winning_state() == float("-inf"):
-            blackwin += 1
-        elif game.winning_state() == 0:
-            tie += 1
+    totals = SearchStats()
+    seeds = [None if seed is None else seed + i for i in range(simulations)]
+    table = None
+    if table_file is not None and os.path.exists(table_file):
+        table = SharedTranspositionTable.load(table_file)
+    elif shared_table or table_file is not None:
+        table = SharedTranspositionTable(shared_table or 1 << 20)
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        futures = {executor.submit(game_result, game_seed, stats, book, red, black, table): i
+                   for i, game_seed in enumerate(seeds)}
+        # Count results in the order the games finish
+        results = ((futures[future], future.result()) for future in as_completed(futures))
+    else:
+        executor = None
+        results = ((i, game_result(game_seed, stats, book, red, black, table)) for i, game_seed in enumerate(seeds))
+    try:
+        for i, (state, game_stats) in results:
+            print(i, end=" ")
+            if game_stats is not None:
+                totals.add(game_stats)
+            if state == float("inf"):
+                redwin += 1
+            elif state == float("-inf"):
+                blackwin += 1
+            elif state == 0:
+                tie += 1
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if table is not None:
+            if table_file is not None:
+                table.save(table_file)
+            table.close()
     print("Red %d (%.0f%%) Black %d (%.0f%%) Tie %d" % (
         redwin, redwin / simulations * 100, blackwin, blackwin / simulations * 100, tie))
+    if stats:
+        print(totals.summary())
 
     return redwin / simulations
 
 
-def single_game(io=True):
-    """Create a game and have two agents play it."""
+def game_result(seed=None, stats=False, book=None, red=None, black=None, table=None):
+    """Play one tournament game and return its winning_state(), with the SearchStats of
+    all minimax moves added up if stats is set (None otherwise)."""
+    if not stats:
+        return single_game(io=False, seed=seed, book=book, red=red, black=black, table=table).last_move_state(), None
+    move_stats = []
+    state = single_game(io=False, seed=seed, stats=move_stats, book=book, red=red, black=black,
+                        table=table).last_move_state()
+    totals = SearchStats()
+    for move_stat in move_stats:
+        totals.add(move_stat)
+    return state, totals
+
+
+def single_game(io=True, seed=None, stats=None, book=None, red=None, black=None, ponder=False, table=None,
+                profile=None):
+    """Create a game and have two agents play it. A seed makes the moves of agents that draw random moves
+    repeatable. If stats is a list, the SearchStats of every minimax move is appended to it. book is the
+    path of an opening book, or an OpeningBook, for the minimax agent. red and black, an Agent class or
+    anything else that makes an agent when called with its colour, replace the default minimax agent for red
+    and random agent for black. ponder has the default minimax agent search on the other agent's time, and
+    table is a transposition table for it to search with instead of a fresh one. profile, a file path, runs the
+    game under a Profiler writing to it."""
+    if profile is not None:
+        with Profiler(profile):
+            return single_game(io, seed, stats, book, red, black, ponder, table)
     game = Game([['-' for i in range(8)] for j in range(8)])  # 8x8 empty board
     if io:
         game.display()
 
-    maxplayer = MinimaxAgent('R')
-    minplayer = RandomAgent('B')
+    if red is None:
+        maxplayer = MinimaxAgent('R', stats=stats is not None, book=book, ponder=ponder, table=table)
+    else:
+        maxplayer = red('R')
+    minplayer = RandomAgent('B') if black is None else black('B')
+    try:
+        if seed is not None:
+            # One seeded stream for both agents; they draw from it in turn, so a game replays exactly
+            rng = random.Random(seed)
+            for player in (maxplayer, minplayer):
+                if hasattr(player, 'rng'):
+                    player.rng = rng
 
-    while True:
-        m = maxplayer.move(game)
-        game = game.neighbor(m, maxplayer.color)
-        if io:
-            time.sleep(.5)
-            game.display()
+        while True:
+            m = maxplayer.move(game)
+            if stats is not None and getattr(maxplayer, 'last_stats', None) is not None:
+                stats.append(maxplayer.last_stats)
+            game = game.neighbor(m, maxplayer.color)
+            if io:
+                time.sleep(.5)
+                game.display()
 
-        if game.winning_state() is not None:
-            break
+            state = game.last_move_state()
+            if state is not None:
+                break
 
-        m = minplayer.move(game)
-        game = game.neighbor(m, minplayer.color)
-        if io:
-            time.sleep(.5)
-            game.display()
+            m = minplayer.move(game)
+            game = game.neighbor(m, minplayer.color)
+            if io:
+                time.sleep(.5)
+                game.display()
 
-        if game.winning_state() is not None:
-            break
+            state = game.last_move_state()
+            if state is not None:
+                break
+    finally:
+        # Stop pondering and worker processes however the game ends, an error or Ctrl-C included
+        for player in (maxplayer, minplayer):
+            if hasattr(player, 'close'):
+                player.close()
 
-    if game.winning_state() == float("inf"):
+    if state == float("inf"):
         print("RED WINS!")
-    elif game.winning_state() == float("-inf"):
+    elif state == float("-inf"):
         print("BLACK WINS!")
-    elif game.winning_state() == 0:
+    elif state == 0:
         print("TIE!")
 
     return game
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show a game of the minimax agent against the random agent, "
+                                                 "then play a tournament between them.")
+    parser.add_argument('--games', type=int, default=100, help="tournament games (default 100; 0 for none)")
+    parser.add_argument('--no-show', action='store_true', help="skip the game shown move by move")
+    parser.add_argument('--workers', type=int, default=1, help="play the tournament in this many processes")
+    parser.add_argument('--seed', type=int, help="seed the games, so a run can be repeated")
+    parser.add_argument('--stats', action='store_true', help="print a summary of the tournament's searches")
+    parser.add_argument('--book', help="opening book for the minimax agent")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="profile the run, printing a hot function and memory report and writing the profile "
+                             "to PATH (PATH.game for the shown game); the tournament then uses one process")
+    args = parser.parse_args(argv)
+
+    if not args.no_show:
+        single_game(io=True, seed=args.seed, book=args.book,
+                    profile=None if args.profile is None else args.profile + '.game')
+    if args.games:
+        tournament(args.games, args.workers, args.seed, args.stats, args.book, profile=args.profile)
+    return 0
+
+
 if __name__ == '__main__':
-    single_game(io=True)
-    tournament(simulations=100)
+    sys.exit(main())
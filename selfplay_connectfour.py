@@ -0,0 +1,204 @@
+import argparse
+import array
+import os
+import random
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from minimax_connectfour import COLS, ROWS, Game, MinimaxAgent, np
+from match_connectfour import opening
+
+# A game file is a header, then one record per game: its seed, result (1 red won, -1 black won, 0 a draw) and
+# number of plies, followed by the column of every ply, one byte each, and the score of every ply as a signed
+# 32-bit int, from the point of view of the side that played it (NO_SCORE for unsearched moves)
+GAMES_MAGIC = b'C4GR'
+GAMES_HEADER = struct.Struct('<4sBBB')
+GAME_RECORD = struct.Struct('<qbB')
+# A position file is a header, then one fixed-size record per position before a move: the red and black
+# bitboards, the column played from it, the result of the game and the score of the move
+POSITIONS_MAGIC = b'C4PS'
+POSITIONS_HEADER = struct.Struct('<4sBBB')
+POSITION_RECORD = struct.Struct('<QQBbi')
+VERSION = 1
+NO_SCORE = -1 << 31
+RESULTS = {float('inf'): 1, 0: 0, float('-inf'): -1}
+
+# The layout of POSITION_RECORD, for reading position files straight into numpy arrays
+if np is not None:
+    POSITION_DTYPE = np.dtype([('red', '<u8'), ('black', '<u8'), ('col', 'u1'), ('result', 'i1'),
+                               ('score', '<i4')])
+
+
+class GameWriter(object):
+    """Appends game records to a game file and, optionally, their positions to a position file."""
+
+    def __init__(self, path, rows=ROWS, cols=COLS, positions=None):
+        self.rows, self.cols = rows, cols
+        self.file = open(path, 'wb')
+        self.file.write(GAMES_HEADER.pack(GAMES_MAGIC, VERSION, rows, cols))
+        self.positions = None
+        if positions is not None:
+            self.positions = open(positions, 'wb')
+            self.positions.write(POSITIONS_HEADER.pack(POSITIONS_MAGIC, VERSION, rows, cols))
+
+    def write(self, seed, result, moves, scores):
+        """Write one game: its seed, result, columns played and the score of each (None if unsearched)."""
+        scores = [NO_SCORE if score is None else score for score in scores]
+        packed = array.array('i', scores)
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        self.file.write(GAME_RECORD.pack(seed, result, len(moves)))
+        self.file.write(bytes(moves))
+        self.file.write(packed.tobytes())
+        if self.positions is not None:
+            game = Game.from_bitboards(0, 0, self.rows, self.cols)
+            for ply, (col, score) in enumerate(zip(moves, scores)):
+                self.positions.write(POSITION_RECORD.pack(game.red, game.black, col, result, score))
+                game.make_move(col, 'RB'[ply % 2])
+
+    def close(self):
+        self.file.close()
+        if self.positions is not None:
+            self.positions.close()
+
+
+def read_header(f, magic, header, path):
+    """Read and check the header of a game or position file; return its board (rows, cols)."""
+    data = f.read(header.size)
+    if len(data) == header.size:
+        found, version, rows, cols = header.unpack(data)
+        if found == magic and version == VERSION:
+            return rows, cols
+    raise ValueError("%s is not a %s file" % (path, 'game' if magic == GAMES_MAGIC else 'position'))
+
+
+def read_games(path):
+    """Yield (seed, result, moves, scores) for every game in a game file, reading one record at a time.
+    moves is a bytes of columns, scores a list with None for unsearched moves."""
+    with open(path, 'rb') as f:
+        read_header(f, GAMES_MAGIC, GAMES_HEADER, path)
+        while True:
+            data = f.read(GAME_RECORD.size)
+            if not data:
+                return
+            if len(data) < GAME_RECORD.size:
+                raise ValueError("%s is cut short" % path)
+            seed, result, plies = GAME_RECORD.unpack(data)
+            moves = f.read(plies)
+            data = f.read(4 * plies)
+            if len(moves) < plies or len(data) < 4 * plies:
+                raise ValueError("%s is cut short" % path)
+            scores = array.array('i', data)
+            if sys.byteorder == 'big':
+                scores.byteswap()
+            yield seed, result, moves, [None if score == NO_SCORE else score for score in scores]
+
+
+def read_positions(path):
+    """Yield (red, black, col, result, score) for every position in a position file, reading it in chunks.
+    score is None for unsearched moves."""
+    with open(path, 'rb') as f:
+        read_header(f, POSITIONS_MAGIC, POSITIONS_HEADER, path)
+        while True:
+            data = f.read(4096 * POSITION_RECORD.size)
+            if not data:
+                return
+            if len(data) % POSITION_RECORD.size:
+                raise ValueError("%s is cut short" % path)
+            for red, black, col, result, score in POSITION_RECORD.iter_unpack(data):
+                yield red, black, col, result, None if score == NO_SCORE else score
+
+
+def position_array(path):
+    """Return the positions of a position file as a read-only numpy memmap of POSITION_DTYPE records, whose
+    red and black columns stack into the bitboard arrays batch_evaluate takes."""
+    if np is None:
+        raise ImportError("position_array needs numpy")
+    with open(path, 'rb') as f:
+        read_header(f, POSITIONS_MAGIC, POSITIONS_HEADER, path)
+    return np.memmap(path, dtype=POSITION_DTYPE, mode='r', offset=POSITIONS_HEADER.size)
+
+
+def self_play(seed, depth, plies, rows=ROWS, cols=COLS):
+    """Play one game of the minimax agent against itself from a random opening of plies moves picked by seed.
+    Return the result, the columns played and the search score of each."""
+    game = Game([['-' for i in range(cols)] for j in range(rows)])
+    moves = opening(random.Random(seed), plies, rows, cols)
+    scores = [None] * len(moves)
+    for ply, col in enumerate(moves):
+        game.make_move(col, 'RB'[ply % 2])
+    players = {color: MinimaxAgent(color, depth=depth, stats=True) for color in 'RB'}
+    try:
+        while True:
+            color = 'RB'[game.move_count % 2]
+            col = players[color].move(game)
+            moves.append(col)
+            scores.append(players[color].last_stats.score)
+            game.make_move(col, color)
+            state = game.last_move_state()
+            if state is not None:
+                return RESULTS[state], moves, scores
+    finally:
+        for player in players.values():
+            player.close()
+
+
+def write_shard(path, positions, seeds, depth, plies, rows=ROWS, cols=COLS):
+    """Worker job: play a self-play game for each seed, writing each to the shard at path as it finishes, and
+    its positions to the shard at positions if that is not None. Return the number of games."""
+    writer = GameWriter(path, rows, cols, positions)
+    try:
+        for seed in seeds:
+            writer.write(seed, *self_play(seed, depth, plies, rows, cols))
+    finally:
+        writer.close()
+    return len(seeds)
+
+
+def generate(prefix, games, workers=1, depth=4, plies=4, seed=0, positions=False, rows=ROWS, cols=COLS):
+    """Play self-play games seeded seed, seed + 1, ... up to seed + games - 1, in workers processes. Worker i
+    writes its games to prefix-<i>.c4g, and with positions their positions to prefix-<i>.c4p.
+    Return the paths of the game files."""
+    shards = min(workers, games) or 1
+    jobs = []
+    for i in range(shards):
+        path = '%s-%03d.c4g' % (prefix, i)
+        jobs.append((path, '%s-%03d.c4p' % (prefix, i) if positions else None,
+                     range(seed + i, seed + games, shards), depth, plies, rows, cols))
+    if shards > 1:
+        with ProcessPoolExecutor(max_workers=shards) as executor:
+            for future in [executor.submit(write_shard, *job) for job in jobs]:
+                future.result()
+    else:
+        write_shard(*jobs[0])
+    return [job[0] for job in jobs]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate connect four self-play games in a binary format.")
+    parser.add_argument('prefix', help="write shards to PREFIX-000.c4g, PREFIX-001.c4g, ...")
+    parser.add_argument('--games', type=int, default=100, help="games to play (default 100)")
+    parser.add_argument('--workers', type=int, default=1, help="play and write shards in this many processes")
+    parser.add_argument('--depth', type=int, default=4, help="search depth of the minimax agent (default 4)")
+    parser.add_argument('--plies', type=int, default=4, help="moves in each random opening (default 4)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game (default 0)")
+    parser.add_argument('--positions', action='store_true',
+                        help="also write every position as packed bitboards to PREFIX-000.c4p, ...")
+    parser.add_argument('--rows', type=int, default=ROWS, help="board rows (default %d)" % ROWS)
+    parser.add_argument('--cols', type=int, default=COLS, help="board columns (default %d)" % COLS)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    paths = generate(args.prefix, args.games, args.workers, args.depth, args.plies, args.seed, args.positions,
+                     args.rows, args.cols)
+    seconds = time.perf_counter() - start
+    size = sum(os.path.getsize(path) for path in paths)
+    print("%d games in %d shards in %.1fs (%.1f games/s), %d bytes (%.0f per game)" % (
+        args.games, len(paths), seconds, args.games / seconds, size, size / max(args.games, 1)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
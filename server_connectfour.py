@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from minimax_connectfour import COLS, ROWS, Game, MinimaxAgent
+
+# Engine agents of a worker process, one per colour, depth and board size, so their tables carry over between
+# requests without positions of one size turning up in searches of another
+_agents = {}
+
+
+def engine_move(red, black, rows, cols, color, depth, deadline):
+    """Worker job: return the engine's move for color in a position, or None if the deadline, a time.time()
+    value, passed while the job waited in the queue."""
+    time_left = deadline - time.time()
+    if time_left <= 0:
+        return None
+    key = (color, depth, rows, cols)
+    if key not in _agents:
+        _agents[key] = MinimaxAgent(color, depth=depth)
+    agent = _agents[key]
+    # Leave a little of the budget for the reply to get back
+    agent.time_limit = time_left * 0.9
+    return agent.move(Game.from_bitboards(red, black, rows, cols))
+
+
+class Session(object):
+    """One game between a client and the engine."""
+
+    def __init__(self, rows, cols, player, depth):
+        self.game = Game([['-' for i in range(cols)] for j in range(rows)])
+        self.player = player
+        self.engine = 'B' if player == 'R' else 'R'
+        self.depth = depth
+        # One request at a time may change the game
+        self.lock = asyncio.Lock()
+
+    def to_move(self):
+        return 'RB'[self.game.move_count % 2]
+
+    def view(self):
+        """Return the game as a JSON-ready dict."""
+        state = self.game.last_move_state() if self.game.move_count else None
+        return {'board': [''.join(row) for row in self.game.grid], 'moves': list(self.game.history),
+                'state': {float('inf'): 'R', float('-inf'): 'B', 0: 'draw', None: None}[state]}
+
+
+class RequestError(Exception):
+    """A request the server cannot carry out; the message goes back to the client."""
+
+
+class GameServer(object):
+    """Hosts games over line-delimited JSON. Each request is one JSON object per line, with an "op" and an
+    optional "id" echoed in the reply:
+
+        {"op": "new", "color": "R", "depth": 4, "rows": 8, "cols": 8}  start a game, playing color
+        {"op": "move", "game": 1, "col": 3}                              play a move; the engine answers
+        {"op": "state", "game": 1}                                       the board, moves and result
+        {"op": "close", "game": 1}                                       end a game
+
+    Replies carry "ok", and "error" when it is false. Engine moves run in a process pool. At most max_pending
+    of them are queued or running at once; beyond that, requests wait, which stops reading from their
+    connections. A request's "deadline", in seconds, defaults to the server's; an engine move that cannot
+    start by then fails with an error, and one that runs short of time plays its best move found so far."""
+
+    def __init__(self, workers=2, max_pending=None, deadline=5.0, depth=4, max_games=10000):
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.pending = asyncio.Semaphore(max_pending or 4 * workers)
+        self.deadline = deadline
+        self.depth = depth
+        self.max_games = max_games
+        self.sessions = {}
+        self.ids = itertools.count(1)
+
+    async def handle(self, reader, writer):
+        """Serve one connection until the client closes it; its games end with it."""
+        owned = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self.dispatch(line, owned)
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for game_id in owned:
+                self.sessions.pop(game_id, None)
+            writer.close()
+
+    async def dispatch(self, line, owned):
+        """Carry out one request line and return the reply."""
+        start = time.time()
+        request = {}
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                raise RequestError("request is not JSON")
+            if not isinstance(request, dict):
+                raise RequestError("request is not a JSON object")
+            seconds = request.get('deadline', self.deadline)
+            # bool is an int to Python, but not a number of seconds
+            if (not isinstance(seconds, (int, float)) or isinstance(seconds, bool) or not math.isfinite(seconds)
+                    or seconds <= 0):
+                raise RequestError("deadline must be a positive number of seconds")
+            deadline = start + seconds
+            op = request.get('op')
+            if op == 'new':
+                reply = await self.new_game(request, owned, deadline)
+            elif op in ('move', 'state', 'close'):
+                game_id = request.get('game')
+                if not isinstance(game_id, int) or isinstance(game_id, bool):
+                    raise RequestError("game must be a game number")
+                session = self.sessions.get(game_id)
+                if session is None:
+                    raise RequestError("no such game")
+                if op == 'move':
+                    reply = await self.play(session, request.get('col'), deadline)
+                elif op == 'state':
+                    reply = session.view()
+                else:
+                    self.sessions.pop(game_id, None)
+                    owned.discard(game_id)
+                    reply = {}
+            else:
+                raise RequestError("unknown op %r" % op)
+            reply['ok'] = True
+        except RequestError as e:
+            reply = {'ok': False, 'error': str(e)}
+        if 'id' in request:
+            reply['id'] = request['id']
+        return reply
+
+    async def new_game(self, request, owned, deadline):
+        if len(self.sessions) >= self.max_games:
+            raise RequestError("too many games")
+        color = request.get('color', 'R')
+        if color not in ('R', 'B'):
+            raise RequestError("color must be R or B")
+        try:
+            rows, cols = int(request.get('rows', ROWS)), int(request.get('cols', COLS))
+            depth = int(request.get('depth', self.depth))
+        except (TypeError, ValueError):
+            raise RequestError("rows, cols and depth must be integers")
+        if not (4 <= rows <= 8 and 4 <= cols <= 8 and 1 <= depth <= 12):
+            raise RequestError("board must be 4x4 to 8x8 and depth 1 to 12")
+        session = Session(rows, cols, color, depth)
+        reply = {}
+        if session.engine == 'R':
+            async with session.lock:
+                reply['engine'] = await self.engine_turn(session, deadline)
+        # Only a game the engine has opened is handed out; one whose first move failed is dropped unseen
+        game_id = next(self.ids)
+        self.sessions[game_id] = session
+        owned.add(game_id)
+        reply['game'] = game_id
+        reply.update(session.view())
+        return reply
+
+    async def play(self, session, col, deadline):
+        async with session.lock:
+            game = session.game
+            if game.move_count and game.last_move_state() is not None:
+                raise RequestError("game is over")
+            if session.to_move() != session.player:
+                raise RequestError("not your move")
+            # bool is an int to Python, but true is not column 1
+            if not isinstance(col, int) or isinstance(col, bool) or not 0 <= col < game.geometry.cols:
+                raise RequestError("col must be a column number")
+            try:
+                game.make_move(col, session.player)
+            except ValueError as e:
+                raise RequestError(str(e))
+            reply = {}
+            if game.last_move_state() is None:
+                try:
+                    reply['engine'] = await self.engine_turn(session, deadline)
+                except RequestError:
+                    # The player's move stands only with the engine's answer
+                    game.unmake_move(col)
+                    raise
+            reply.update(session.view())
+            return reply
+
+    async def engine_turn(self, session, deadline):
+        """Search the engine's move in the pool, within the deadline, and play it."""
+        game = session.game
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self.pending.acquire(), deadline - time.time())
+        except asyncio.TimeoutError:
+            raise RequestError("deadline exceeded")
+        try:
+            col = await loop.run_in_executor(self.pool, engine_move, game.red, game.black, game.geometry.rows,
+                                             game.geometry.cols, session.engine, session.depth, deadline)
+        finally:
+            self.pending.release()
+        if col is None:
+            raise RequestError("deadline exceeded")
+        game.make_move(col, session.engine)
+        return col
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def serve(host, port, **options):
+    """Run a GameServer on host and port until cancelled."""
+    game_server = GameServer(**options)
+    server = await asyncio.start_server(game_server.handle, host, port)
+    print("serving on %s" % ', '.join(str(sock.getsockname()) for sock in server.sockets), flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        game_server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve connect four games over line-delimited JSON.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="port to listen on (default 8765)")
+    parser.add_argument('--workers', type=int, default=2, help="engine processes (default 2)")
+    parser.add_argument('--max-pending', type=int, help="engine moves queued or running at once "
+                                                        "(default 4 per worker)")
+    parser.add_argument('--deadline', type=float, default=5.0, help="default seconds per request (default 5)")
+    parser.add_argument('--depth', type=int, default=4, help="default engine search depth (default 4)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers, max_pending=args.max_pending,
+                          deadline=args.deadline, depth=args.depth))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
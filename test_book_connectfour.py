@@ -0,0 +1,106 @@
+import pytest
+
+from book_connectfour import build, positions
+from minimax_connectfour import BOOK_HEADER, Game, MinimaxAgent, OpeningBook
+
+
+def test_book_round_trip(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    moves = {5: 3, 1 << 63: 0, 12345678901234567: 6, 2: 7}
+    OpeningBook.write(path, moves, rows=6, cols=8, plies=3)
+    book = OpeningBook(path)
+    try:
+        assert (book.rows, book.cols, book.plies, len(book)) == (6, 8, 3, len(moves))
+        for key, col in moves.items():
+            assert book.lookup(key) == col
+        for key in (0, 1, 3, 6, (1 << 64) - 1):
+            assert book.lookup(key) is None
+    finally:
+        book.close()
+
+
+def test_empty_book(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    OpeningBook.write(path, {})
+    book = OpeningBook(path)
+    assert len(book) == 0 and book.lookup(5) is None
+    book.close()
+
+
+def test_bad_books_are_refused(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    OpeningBook.write(path, {5: 3, 9: 2})
+    with open(path, 'rb') as f:
+        data = f.read()
+    # Cut short, with a wrong magic, and with a version from before
+    for bad in (data[:-1], data[:BOOK_HEADER.size - 1], b'XXXX' + data[4:], data[:4] + b'\x01' + data[5:]):
+        with open(path, 'wb') as f:
+            f.write(bad)
+        with pytest.raises(ValueError):
+            OpeningBook(path)
+
+
+def test_built_book_covers_its_positions(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    count = build(path, plies=2, depth=2, rows=5, cols=6)
+    found = positions(2, 5, 6)
+    assert count == len(found)
+    book = OpeningBook(path)
+    try:
+        assert len(book) == len(found)
+        for key, (red, black, mirrored) in found.items():
+            game = Game.from_bitboards(red, black, 5, 6)
+            color = 'RB'[game.move_count % 2]
+            assert MinimaxAgent(color, book=book).book_move(game) in game.possible_moves()
+        # Positions past the plies the book covers, and boards of another size, are searched instead
+        game = Game.from_bitboards(0, 0, 5, 6)
+        for col in (0, 1, 2):
+            game.make_move(col, 'RB'[game.move_count % 2])
+        assert MinimaxAgent('B', book=book).book_move(game) is None
+        assert MinimaxAgent('R', book=book).book_move(Game.from_bitboards(0, 0, 6, 7)) is None
+    finally:
+        book.close()
+
+
+def mirror(game):
+    """Return the game with its moves mirrored left to right."""
+    mirrored = Game.from_bitboards(0, 0, game.geometry.rows, game.geometry.cols)
+    for ply, col in enumerate(game.history):
+        mirrored.make_move(game.mirror_col(col), 'RB'[ply % 2])
+    return mirrored
+
+
+def test_mirror_images_share_a_record(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    game = Game.from_bitboards(0, 0, 6, 7)
+    game.make_move(1, 'R')
+    # The book stores the move for the canonical orientation, whichever of the two that is
+    key, mirrored = game.canonical_key(False)
+    OpeningBook.write(path, {key: game.mirror_col(2) if mirrored else 2}, 6, 7, plies=1)
+    book = OpeningBook(path)
+    try:
+        assert len(book) == 1
+        assert MinimaxAgent('B', book=book).book_move(game) == 2
+        assert MinimaxAgent('B', book=book).book_move(mirror(game)) == 4
+        # The same board with the other side to move is another position
+        assert MinimaxAgent('R', book=book).book_move(game) is None
+    finally:
+        book.close()
+
+
+def test_built_book_mirrors_its_moves(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    build(path, plies=2, depth=2, rows=5, cols=6)
+    book = OpeningBook(path)
+    try:
+        game = Game.from_bitboards(0, 0, 5, 6)
+        for first in range(6):
+            game.make_move(first, 'R')
+            for second in range(6):
+                game.make_move(second, 'B')
+                col = MinimaxAgent('R', book=book).book_move(game)
+                assert MinimaxAgent('R', book=book).book_move(mirror(game)) == game.mirror_col(col)
+                game.unmake_move(second)
+            game.unmake_move(first)
+    finally:
+        book.close()
@@ -0,0 +1,59 @@
+import math
+
+import pytest
+
+from match_connectfour import MatchStats, agent_factory, elo, expected_score, match
+from minimax_connectfour import MinimaxAgent
+
+
+def test_elo_known_values():
+    assert elo(0.5) == 0
+    assert elo(0.75) == pytest.approx(400 * math.log10(3))
+    assert elo(0.25) == pytest.approx(-400 * math.log10(3))
+    assert elo(0) == float('-inf') and elo(1) == float('inf')
+    for score in (0.1, 0.3, 0.5, 0.64, 0.9):
+        assert expected_score(elo(score)) == pytest.approx(score)
+
+
+def test_match_stats_known_values():
+    stats = MatchStats()
+    for scores in ((1, 1), (0.5, 0.5), (1, 0)):
+        stats.add(scores)
+    assert stats.pairs == [0, 0, 2, 0, 1]
+    assert (stats.wins, stats.draws, stats.losses, stats.games) == (3, 2, 1, 6)
+    mean, variance = stats.score()
+    assert mean == pytest.approx(2 / 3) and variance == pytest.approx(1 / 18)
+    # Elo of a 2/3 score, give or take 1.96 standard errors of the mean over 3 pairs
+    margin = 1.96 * math.sqrt(1 / 18 / 3)
+    assert stats.elo() == pytest.approx((elo(2 / 3), elo(2 / 3 - margin), elo(2 / 3 + margin)))
+    s1 = expected_score(30)
+    assert stats.llr(0, 30) == pytest.approx(3 * (s1 - 0.5) * (4 / 3 - 0.5 - s1) / (2 / 18))
+    assert stats.summary().startswith("6 games: +3 =2 -1, pairs 0/0/2/0/1, Elo +120.4")
+
+
+def test_llr_sides_with_the_results():
+    even, ahead = MatchStats(), MatchStats()
+    for i in range(20):
+        even.add((1, 0))
+        ahead.add((1, 1))
+    # Even results sit halfway between hypotheses placed evenly around 0
+    assert even.llr(-20, 20) == pytest.approx(0)
+    assert even.llr(0, 30) < 0
+    # One-sided results have no spread; the variance floor keeps the ratio finite
+    assert 0 < ahead.llr(0, 30) < math.inf
+
+
+def test_agent_factory():
+    make = agent_factory('minimax:depth=3,time_limit=0.5,threats=False')
+    agent = make('B')
+    assert isinstance(agent, MinimaxAgent)
+    assert (agent.color, agent.depth, agent.time_limit, agent.threats) == ('B', 3, 0.5, False)
+    with pytest.raises(ValueError):
+        agent_factory('alphazero')
+
+
+def test_match_stops_when_the_test_decides():
+    stats, verdict = match(agent_factory('minimax:depth=2'), agent_factory('random'), min_pairs=5,
+                           log=lambda line: None)
+    assert verdict == 'H1'
+    assert stats.games == 2 * sum(stats.pairs) < 2 * 500
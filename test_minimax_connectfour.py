@@ -0,0 +1,286 @@
+import math
+import pickle
+import random
+
+import pytest
+
+from minimax_connectfour import (WIN_SCORE, Game, MCTSAgent, MinimaxAgent, SharedTranspositionTable, TranspositionTable,
+                                 batch_evaluate, bitboard_array, np)
+
+# Board sizes the tests play on: the standard one, the classic 6x7, and small ones an exhaustive search can finish
+SIZES = ((8, 8), (6, 7), (4, 5), (5, 4))
+
+
+def random_game(rng, rows, cols, plies):
+    """Return a game of up to plies random moves, red first, that nobody has won yet."""
+    game = Game.from_bitboards(0, 0, rows, cols)
+    for ply in range(plies):
+        col = rng.choice(game.possible_moves())
+        game.make_move(col, 'RB'[ply % 2])
+        if game.last_move_state() is not None:
+            game.unmake_move(col)
+            break
+    return game
+
+
+def random_endgame(rng, rows, cols, empty):
+    """Return an open game with about empty cells left, for the side to move."""
+    while True:
+        game = random_game(rng, rows, cols, rows * cols - empty)
+        if game.move_count == rows * cols - empty:
+            return game
+
+
+def brute_solve(game, red_to_move):
+    """Value of a position to the side to move by walking the whole game tree, in the solver's units: the empty
+    cells left after a winning move plus one, negated for a loss, 0 for a draw."""
+    color = 'R' if red_to_move else 'B'
+    best = -math.inf
+    for col in game.possible_moves():
+        game.make_move(col, color)
+        if game.is_win_at(col):
+            value = game.geometry.cells - game.move_count + 1
+        elif game.is_full():
+            value = 0
+        else:
+            value = -brute_solve(game, not red_to_move)
+        game.unmake_move(col)
+        best = max(best, value)
+    return best
+
+
+def brute_minimax(game, layer, red_to_move):
+    """Depth-limited minimax without pruning, scoring like MinimaxAgent.negamax without threat search."""
+    if layer == 0:
+        return game.utility() if red_to_move else -game.utility()
+    color = 'R' if red_to_move else 'B'
+    best = -math.inf
+    for col in game.possible_moves():
+        game.make_move(col, color)
+        value = MinimaxAgent.terminal_value(game, col, layer)
+        if value is None:
+            value = -brute_minimax(game, layer - 1, not red_to_move)
+        game.unmake_move(col)
+        best = max(best, value)
+    return best
+
+
+def brute_threats(game, red_to_move):
+    """Game.threats worked out by dropping pieces and looking for fours."""
+    color, other = ('R', 'B') if red_to_move else ('B', 'R')
+    rows = game.geometry.rows
+    wins = blocks = unplayable = 0
+    for col in game.possible_moves():
+        cell = 1 << (col * rows + game.heights[col])
+        game.make_move(col, color)
+        wins |= cell if game.is_win_at(col) else 0
+        if game.heights[col] < rows:
+            game.make_move(col, other)
+            unplayable |= cell if game.is_win_at(col) else 0
+            game.unmake_move(col)
+        game.unmake_move(col)
+        game.make_move(col, other)
+        blocks |= cell if game.is_win_at(col) else 0
+        game.unmake_move(col)
+    return wins, blocks, unplayable
+
+
+def solver_value(value):
+    """Turn a solver value into the root value solve_root returns."""
+    if value > 0:
+        return WIN_SCORE + value - 1
+    if value < 0:
+        return -WIN_SCORE + value + 1
+    return 0
+
+
+@pytest.mark.parametrize('rows, cols', SIZES)
+def test_incremental_state_matches_rebuild(rows, cols):
+    rng = random.Random(rows * 10 + cols)
+    for trial in range(100):
+        game = random_game(rng, rows, cols, rng.randrange(rows * cols))
+        # Take some of the moves back too, so unmake_move is checked as well
+        for i in range(rng.randrange(game.move_count + 1)):
+            game.unmake_move(game.history[-1])
+        rebuilt = Game.from_bitboards(game.red, game.black, rows, cols)
+        assert game.score == rebuilt.score == game.redscore() - game.blackscore()
+        assert (game.hash, game.mirror_hash) == (rebuilt.hash, rebuilt.mirror_hash)
+        assert (game.red_counts, game.black_counts) == (rebuilt.red_counts, rebuilt.black_counts)
+        assert game.heights == rebuilt.heights
+
+
+def test_unmake_move_only_takes_back_the_last_move():
+    game = Game.from_bitboards(0, 0, 6, 7)
+    with pytest.raises(ValueError):
+        game.unmake_move(3)
+    game.make_move(2, 'R')
+    game.make_move(4, 'B')
+    for col in (3, 2):
+        with pytest.raises(ValueError):
+            game.unmake_move(col)
+    assert game.history == [2, 4]
+    game.unmake_move(4)
+    game.unmake_move(2)
+    assert (game.red, game.black, game.history, game.heights) == (0, 0, [], [0] * 7)
+
+
+def test_mirror_hash_is_hash_of_mirrored_board():
+    rng = random.Random(1)
+    for trial in range(100):
+        game = random_game(rng, 6, 7, rng.randrange(42))
+        mirrored = Game.from_bitboards(0, 0, 6, 7)
+        for ply, col in enumerate(game.history):
+            mirrored.make_move(game.mirror_col(col), 'RB'[ply % 2])
+        assert mirrored.hash == game.mirror_hash
+        for red_to_move in (True, False):
+            assert game.canonical_key(red_to_move)[0] == mirrored.canonical_key(red_to_move)[0]
+
+
+def test_board_sizes_hash_apart():
+    # The same bitboards on boards of different sizes are different positions
+    hashes = {Game.from_bitboards(0b101, 0b10, rows, cols).hash for rows, cols in SIZES}
+    assert len(hashes) == len(SIZES)
+
+
+@pytest.mark.parametrize('rows, cols', SIZES)
+def test_threats_match_brute_force(rows, cols):
+    rng = random.Random(rows * 10 + cols)
+    for trial in range(200):
+        game = random_game(rng, rows, cols, rng.randrange(rows * cols))
+        for red_to_move in (True, False):
+            assert game.threats(red_to_move) == brute_threats(game, red_to_move)
+
+
+@pytest.mark.parametrize('rows, cols', ((4, 5), (5, 4), (6, 7)))
+def test_solver_is_exact(rows, cols):
+    rng = random.Random(rows * 10 + cols)
+    for trial in range(30):
+        game = random_endgame(rng, rows, cols, rng.randrange(1, 11))
+        red_to_move = game.move_count % 2 == 0
+        expected = brute_solve(game, red_to_move)
+        for threats in (True, False):
+            agent = MinimaxAgent('R', threats=threats)
+            col, value = agent.solve_root(game, red_to_move)
+            assert value == solver_value(expected)
+            # The move found reaches the value
+            game.make_move(col, 'R' if red_to_move else 'B')
+            if game.is_win_at(col):
+                reached = game.geometry.cells - game.move_count + 1
+            elif game.is_full():
+                reached = 0
+            else:
+                reached = -brute_solve(game, not red_to_move)
+            game.unmake_move(col)
+            assert reached == expected
+
+
+@pytest.mark.parametrize('rows, cols', ((8, 8), (6, 7)))
+def test_negamax_matches_minimax(rows, cols):
+    rng = random.Random(rows * 10 + cols)
+    for trial in range(40):
+        game = random_game(rng, rows, cols, rng.randrange(4, rows * cols - 8))
+        red_to_move = game.move_count % 2 == 0
+        depth = rng.randrange(1, 4)
+        # Threat search prunes and extends, so it only matches plain minimax in solved values
+        agent = MinimaxAgent('R', depth=depth, threats=False, endgame=0)
+        assert agent.negamax(game, depth, red_to_move, -math.inf, math.inf)[1] == \
+            brute_minimax(game, depth, red_to_move)
+
+
+@pytest.mark.skipif(np is None, reason="needs numpy")
+@pytest.mark.parametrize('rows, cols', SIZES)
+def test_batch_evaluate_matches_utility(rows, cols):
+    rng = random.Random(rows * 10 + cols)
+    games = [random_game(rng, rows, cols, rng.randrange(rows * cols)) for trial in range(100)]
+    scores, winners = batch_evaluate(bitboard_array(games), rows, cols)
+    assert scores.tolist() == [game.utility() for game in games]
+    assert not winners.any()
+    # The grid layout scores the same
+    grids = np.array([[[{'R': 1, 'B': -1, '-': 0}[mark] for mark in row] for row in game.grid] for game in games],
+                     dtype=np.int8)
+    assert batch_evaluate(grids)[0].tolist() == scores.tolist()
+
+
+@pytest.mark.skipif(np is None, reason="needs numpy")
+def test_batch_search_matches_plain_search():
+    rng = random.Random(3)
+    for trial in range(60):
+        game = random_game(rng, 8, 8, rng.randrange(4, 56))
+        red_to_move = game.move_count % 2 == 0
+        depth = rng.randrange(1, 5)
+        # Without a table the values cannot depend on what earlier searches stored
+        values = [MinimaxAgent('R', depth=depth, table_size=0, batch=batch).negamax(
+            game, depth, red_to_move, -math.inf, math.inf)[1] for batch in (False, True)]
+        assert values[0] == values[1]
+
+
+def test_mcts_needs_a_budget():
+    for options in ({'iterations': None}, {'iterations': 0}, {'rollouts': 0}):
+        with pytest.raises(ValueError):
+            MCTSAgent('R', **options)
+
+
+def random_entries(rng, count):
+    """Return random table stores as (key, layer, value, bound, col), wins and losses among them."""
+    entries = []
+    for i in range(count):
+        value = rng.choice((rng.randrange(-5000, 5000), WIN_SCORE + rng.randrange(40), -WIN_SCORE - rng.randrange(40)))
+        entries.append((rng.getrandbits(64), rng.randrange(1, 40), value, rng.randrange(3),
+                        rng.choice((None, rng.randrange(16)))))
+    return entries
+
+
+def test_shared_table_packs_like_the_plain_table():
+    rng = random.Random(1)
+    # A small table, so stores collide and replace each other the way the plain table's do
+    shared, plain = SharedTranspositionTable(64), TranspositionTable(64)
+    try:
+        entries = random_entries(rng, 500)
+        for key, layer, value, bound, col in entries:
+            shared.store(key, layer, value, bound, col)
+            plain.store(key, layer, value, bound, col)
+            for key, layer, value, bound, col in rng.sample(entries, 5):
+                at = rng.randrange(40)
+                assert shared.lookup(key, at) == plain.lookup(key, at)
+        shared.clear()
+        assert all(shared.lookup(key, 0) is None for key, layer, value, bound, col in entries)
+    finally:
+        shared.close()
+
+
+def test_shared_table_is_shared_through_pickling():
+    table = SharedTranspositionTable(256)
+    try:
+        table.store(12345, 6, -70, TranspositionTable.LOWER, 3)
+        # Pickling hands over the memory, as sending the table to a worker process does
+        attached = pickle.loads(pickle.dumps(table))
+        assert attached.lookup(12345, 0) == (6, -70, TranspositionTable.LOWER, 3)
+        attached.store(999, 2, 40, TranspositionTable.EXACT, None)
+        assert table.lookup(999, 0) == (2, 40, TranspositionTable.EXACT, None)
+    finally:
+        table.close()
+
+
+def test_shared_table_save_and_load(tmp_path):
+    path = str(tmp_path / 'table.bin')
+    rng = random.Random(2)
+    table = SharedTranspositionTable(1 << 10)
+    try:
+        for key, layer, value, bound, col in random_entries(rng, 300):
+            table.store(key, layer, value, bound, col)
+        table.save(path)
+        loaded = SharedTranspositionTable.load(path)
+        try:
+            assert loaded.buckets == table.buckets
+            assert bytes(loaded.memory.buf[:32 * loaded.buckets]) == bytes(table.memory.buf[:32 * table.buckets])
+        finally:
+            loaded.close()
+    finally:
+        table.close()
+    with open(path, 'rb') as f:
+        data = f.read()
+    for bad in (data[:-8], data[:5], b'XXXX' + data[4:]):
+        with open(path, 'wb') as f:
+            f.write(bad)
+        with pytest.raises(ValueError):
+            SharedTranspositionTable.load(path)
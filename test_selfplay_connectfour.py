@@ -0,0 +1,87 @@
+import pytest
+
+from minimax_connectfour import Game, np
+from selfplay_connectfour import (GAME_RECORD, NO_SCORE, GameWriter, generate, position_array, read_games,
+                                  read_positions)
+
+# Two short games on a 6x7 board: a red win up the first column, and a game cut off unfinished as a draw
+GAMES = [
+    (7, 1, [0, 1, 0, 1, 0, 1, 0], [None, 12, -3, None, 1000000, -999999, 1000001]),
+    (-(1 << 40), 0, [3, 3, 4], [0, None, -(1 << 31) + 1]),
+]
+
+
+def write_games(tmp_path):
+    path, positions = str(tmp_path / 'games.c4g'), str(tmp_path / 'games.c4p')
+    writer = GameWriter(path, 6, 7, positions)
+    for game in GAMES:
+        writer.write(*game)
+    writer.close()
+    return path, positions
+
+
+def test_games_round_trip(tmp_path):
+    path, positions = write_games(tmp_path)
+    assert [(seed, result, list(moves), scores) for seed, result, moves, scores in read_games(path)] == GAMES
+
+
+def test_positions_round_trip(tmp_path):
+    path, positions = write_games(tmp_path)
+    expected = []
+    for seed, result, moves, scores in GAMES:
+        game = Game.from_bitboards(0, 0, 6, 7)
+        for ply, (col, score) in enumerate(zip(moves, scores)):
+            expected.append((game.red, game.black, col, result, score))
+            game.make_move(col, 'RB'[ply % 2])
+    assert list(read_positions(positions)) == expected
+
+
+@pytest.mark.skipif(np is None, reason="needs numpy")
+def test_position_array(tmp_path):
+    path, positions = write_games(tmp_path)
+    records = list(read_positions(positions))
+    array = position_array(positions)
+    assert len(array) == len(records)
+    assert array['red'].tolist() == [record[0] for record in records]
+    assert array['col'].tolist() == [record[2] for record in records]
+    assert array['score'].tolist() == [NO_SCORE if record[4] is None else record[4] for record in records]
+
+
+def test_cut_short_files_are_refused(tmp_path):
+    path, positions = write_games(tmp_path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    # Inside the last record's header, moves and scores, and in the file header
+    for end in (-GAME_RECORD.size - 3 * 5 + 1, -3 * 4 - 1, -1, 3):
+        with open(path, 'wb') as f:
+            f.write(data[:end])
+        with pytest.raises(ValueError):
+            list(read_games(path))
+    with open(positions, 'rb') as f:
+        data = f.read()
+    with open(positions, 'wb') as f:
+        f.write(data[:-1])
+    with pytest.raises(ValueError):
+        list(read_positions(positions))
+    # A game file is not a position file
+    with pytest.raises(ValueError):
+        list(read_positions(path))
+
+
+def test_generate(tmp_path):
+    paths = generate(str(tmp_path / 'selfplay'), games=3, workers=1, depth=1, plies=2, seed=5, positions=True,
+                     rows=5, cols=6)
+    games = [game for path in paths for game in read_games(path)]
+    assert sorted(game[0] for game in games) == [5, 6, 7]
+    plies = 0
+    for seed, result, moves, scores in games:
+        # Replaying a game reaches its result on its last move
+        game = Game.from_bitboards(0, 0, 5, 6)
+        for ply, col in enumerate(moves):
+            assert game.last_move_state() is None
+            game.make_move(col, 'RB'[ply % 2])
+        assert {float('inf'): 1, 0: 0, float('-inf'): -1}[game.last_move_state()] == result
+        # The random opening is not searched
+        assert scores[:2] == [None, None] and None not in scores[2:]
+        plies += len(moves)
+    assert sum(1 for path in paths for position in read_positions(path[:-1] + 'p')) == plies
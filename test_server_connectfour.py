@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+from server_connectfour import GameServer
+
+
+def run_requests(requests, **options):
+    """Send request lines to a fresh server's dispatch and return the replies and the games left open."""
+    async def run():
+        server = GameServer(workers=1, **options)
+        owned = set()
+        try:
+            replies = []
+            for request in requests:
+                line = request if isinstance(request, bytes) else json.dumps(request).encode()
+                replies.append(await server.dispatch(line, owned))
+            return replies, set(server.sessions), owned
+        finally:
+            server.close()
+    return asyncio.run(run())
+
+
+def test_bad_fields_get_error_replies():
+    replies, sessions, owned = run_requests([
+        b'not json', b'[1]', {'op': 'fly'},
+        {'op': 'state', 'game': [1], 'id': 'a'}, {'op': 'state', 'game': True}, {'op': 'state', 'game': 99},
+        {'op': 'new', 'deadline': 'soon'}, {'op': 'new', 'deadline': None}, b'{"op": "new", "deadline": NaN}',
+        {'op': 'new', 'deadline': 0}, {'op': 'new', 'color': 'G'}, {'op': 'new', 'rows': 9},
+    ])
+    assert all(reply['ok'] is False and reply['error'] for reply in replies)
+    assert replies[3]['id'] == 'a'
+    assert sessions == owned == set()
+
+
+def test_bad_moves_are_refused():
+    replies, sessions, owned = run_requests([
+        {'op': 'new', 'rows': 6, 'cols': 7},
+        {'op': 'move', 'game': 1, 'col': True}, {'op': 'move', 'game': 1, 'col': 7},
+        {'op': 'move', 'game': 1, 'col': '3'}, {'op': 'move', 'game': 1, 'col': 3},
+    ])
+    assert replies[0]['ok'] and replies[0]['game'] == 1 and replies[0]['moves'] == []
+    assert [reply['ok'] for reply in replies[1:]] == [False, False, False, True]
+    # Only the good move was played, with the engine's answer
+    assert replies[4]['moves'] == [3, replies[4]['engine']]
+    assert sessions == owned == {1}
+
+
+def test_engine_opening_that_fails_leaves_no_game():
+    replies, sessions, owned = run_requests([
+        {'op': 'new', 'color': 'B', 'deadline': 1e-9}, {'op': 'new', 'color': 'B'}, {'op': 'close', 'game': 1},
+    ])
+    assert replies[0] == {'ok': False, 'error': 'deadline exceeded'}
+    # The game the engine opened is the first one handed out
+    assert replies[1]['ok'] and replies[1]['game'] == 1 and replies[1]['moves'] == [replies[1]['engine']]
+    assert replies[2] == {'ok': True}
+    assert sessions == owned == set()